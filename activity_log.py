@@ -0,0 +1,319 @@
+import datetime as dt
+import asyncio
+import json
+import glob
+import gzip
+import os
+
+import pytz
+
+from utils import db
+
+
+PAGE_SIZE = 50
+ARCHIVE_FETCH_SIZE = 1000
+# rows per archive file, a page only opens the files its rows can be in
+ARCHIVE_PART_SIZE = 5000
+
+
+def encode_cursor(log):
+    return f"{log['log_dt'].isoformat()}_{log['id']}"
+
+
+def decode_cursor(cursor):
+    try:
+        log_dt, log_id = cursor.rsplit("_", 1)
+        return dt.datetime.fromisoformat(log_dt), int(log_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+def parse_date(value):
+    try:
+        return dt.date.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+async def fetch_logs(
+    cursor=None,
+    actor_role=None,
+    actor_id=None,
+    date_from=None,
+    date_to=None,
+    search=None,
+    limit=PAGE_SIZE,
+    pool=None,
+):
+    conditions = []
+    args = []
+
+    def arg(value):
+        args.append(value)
+        return f"${len(args)}"
+
+    after = decode_cursor(cursor) if cursor else None
+    if after:
+        conditions.append(f"(log_dt, id) < ({arg(after[0])}, {arg(after[1])})")
+    if actor_role:
+        conditions.append(f"actor_role = {arg(actor_role)}")
+    if actor_id is not None:
+        conditions.append(f"actor_id = {arg(actor_id)}")
+    if date_from:
+        conditions.append(f"log_dt >= {arg(dt.datetime.combine(date_from, dt.time()))}")
+    if date_to:
+        conditions.append(
+            f"log_dt < {arg(dt.datetime.combine(date_to + dt.timedelta(days=1), dt.time()))}"
+        )
+    if search:
+        escaped = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        conditions.append(f"message ILIKE {arg(f'%{escaped}%')}")
+
+    where = " AND ".join(conditions) or "TRUE"
+    # one extra row tells whether there is a next page
+    logs = await (pool or db.pool).fetch(
+        f"SELECT * FROM logs WHERE {where} ORDER BY log_dt DESC, id DESC LIMIT {arg(limit + 1)}",
+        *args,
+    )
+
+    next_cursor = encode_cursor(logs[limit - 1]) if len(logs) > limit else None
+    return logs[:limit], next_cursor
+
+
+def _month_start(day, months_back=0):
+    month = day.year * 12 + day.month - 1 - months_back
+    return dt.datetime(month // 12, month % 12 + 1, 1)
+
+
+def _matches(log, actor_role, actor_id, date_from, date_to, search):
+    if actor_role and log["actor_role"] != actor_role:
+        return False
+    if actor_id is not None and log["actor_id"] != actor_id:
+        return False
+    if date_from and log["log_dt"].date() < date_from:
+        return False
+    if date_to and log["log_dt"].date() > date_to:
+        return False
+    if search and search.lower() not in log["message"].lower():
+        return False
+
+    return True
+
+
+def _log_key(log):
+    return log["log_dt"], log["id"]
+
+
+def _read_archive(path):
+    logs = []
+    with gzip.open(path, "rt") as f:
+        for line in f:
+            log = json.loads(line)
+            log["log_dt"] = dt.datetime.fromisoformat(log["log_dt"])
+            logs.append(log)
+
+    logs.sort(key=_log_key, reverse=True)
+    return logs
+
+
+def _index_key(key):
+    return dt.datetime.fromisoformat(key[0]), key[1]
+
+
+class LogArchiver:
+    def __init__(self, archive_dir, retention_months=6, interval=3600, lock_key=8246):
+        self.archive_dir = archive_dir
+        self.retention_months = retention_months
+        self.interval = interval
+        self.lock_key = lock_key
+        self.task = None
+
+    def _paths(self, month):
+        return sorted(glob.glob(os.path.join(self.archive_dir, f"logs-{month}*.jsonl.gz")))
+
+    def _index_path(self, month):
+        return os.path.join(self.archive_dir, f"logs-{month}.index.json")
+
+    def _read_index(self, month):
+        try:
+            with open(self._index_path(month)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    def _parts(self, month):
+        # (path, oldest key, newest key), files written before the index or by an
+        # interrupted run have no range and are always read
+        index = self._read_index(month)
+        parts = []
+        for path in self._paths(month):
+            entry = index.get(os.path.basename(path))
+            if entry:
+                parts.append((path, _index_key(entry["first"]), _index_key(entry["last"])))
+            else:
+                parts.append((path, None, None))
+
+        parts.sort(key=lambda part: part[2] or (dt.datetime.max, 0), reverse=True)
+        return parts
+
+    def months(self):
+        if not self.archive_dir:
+            return []
+
+        names = glob.glob(os.path.join(self.archive_dir, "logs-*.jsonl.gz"))
+        return sorted({os.path.basename(name)[5:12] for name in names}, reverse=True)
+
+    async def fetch(
+        self,
+        month,
+        cursor=None,
+        actor_role=None,
+        actor_id=None,
+        date_from=None,
+        date_to=None,
+        search=None,
+        limit=PAGE_SIZE,
+    ):
+        after = decode_cursor(cursor) if cursor else None
+        found = {}
+        page = []
+        for path, first, last in await asyncio.to_thread(self._parts, month):
+            if after and first and first >= after:
+                continue
+            # parts come newest first, once a page is full an older part cannot change it
+            if len(page) > limit and last and last < _log_key(page[limit]):
+                break
+
+            for log in await asyncio.to_thread(_read_archive, path):
+                if after and _log_key(log) >= after:
+                    continue
+                if _matches(log, actor_role, actor_id, date_from, date_to, search):
+                    # a part written before a failed delete repeats rows of the next one
+                    found[log["id"]] = log
+            page = sorted(found.values(), key=_log_key, reverse=True)
+
+        next_cursor = encode_cursor(page[limit - 1]) if len(page) > limit else None
+        return page[:limit], next_cursor
+
+    def _archive_path(self, month):
+        # a month archived twice gets a second chunk instead of overwriting
+        chunk = len(self._paths(month))
+        suffix = f".{chunk}" if chunk else ""
+        return os.path.join(self.archive_dir, f"logs-{month}{suffix}.jsonl.gz")
+
+    async def _write_part(self, month, rows):
+        path = self._archive_path(month)
+        tmp = path + ".tmp"
+        lines = "".join(
+            json.dumps({**dict(row), "log_dt": row["log_dt"].isoformat()}) + "\n"
+            for row in rows
+        )
+
+        def write():
+            with gzip.open(tmp, "wt") as f:
+                f.write(lines)
+            os.replace(tmp, path)
+
+        await asyncio.to_thread(write)
+        return os.path.basename(path), {
+            "first": [rows[0]["log_dt"].isoformat(), rows[0]["id"]],
+            "last": [rows[-1]["log_dt"].isoformat(), rows[-1]["id"]],
+            "count": len(rows),
+        }
+
+    def _write_index(self, month, entries):
+        index = self._read_index(month)
+        index.update(entries)
+        tmp = self._index_path(month) + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp, self._index_path(month))
+
+    async def _archive_month(self, conn, start):
+        end = _month_start(start, -1)
+        month = start.strftime("%Y-%m")
+
+        count = 0
+        entries = {}
+        rows = []
+        cursor = await conn.cursor(
+            "SELECT * FROM logs WHERE log_dt >= $1 AND log_dt < $2 ORDER BY log_dt, id",
+            start,
+            end,
+        )
+        while batch := await cursor.fetch(ARCHIVE_FETCH_SIZE):
+            rows.extend(batch)
+            count += len(batch)
+            while len(rows) >= ARCHIVE_PART_SIZE:
+                name, entry = await self._write_part(month, rows[:ARCHIVE_PART_SIZE])
+                entries[name] = entry
+                rows = rows[ARCHIVE_PART_SIZE:]
+
+        if rows:
+            name, entry = await self._write_part(month, rows)
+            entries[name] = entry
+
+        if not count:
+            return 0
+
+        await asyncio.to_thread(self._write_index, month, entries)
+        # rows are only removed once the files are in place, in the same transaction
+        await conn.execute(
+            "DELETE FROM logs WHERE log_dt >= $1 AND log_dt < $2", start, end
+        )
+        return count
+
+    async def archive(self):
+        now = dt.datetime.now(pytz.timezone("Asia/Jakarta")).replace(tzinfo=None)
+        cutoff = _month_start(now, self.retention_months)
+        os.makedirs(self.archive_dir, exist_ok=True)
+
+        archived = 0
+        async with db.session().acquire() as conn:
+            # one process archives, the others skip this round
+            if not await conn.fetchval("SELECT pg_try_advisory_lock($1)", self.lock_key):
+                return 0
+
+            try:
+                months = await conn.fetch(
+                    "SELECT DISTINCT date_trunc('month', log_dt) AS month FROM logs WHERE log_dt < $1 ORDER BY month",
+                    cutoff,
+                )
+                for row in months:
+                    async with conn.transaction():
+                        count = await self._archive_month(conn, row["month"])
+                    archived += count
+                    print(f"logs: archived {count} rows of {row['month']:%Y-%m}")
+            finally:
+                await conn.execute("SELECT pg_advisory_unlock($1)", self.lock_key)
+
+        return archived
+
+    async def run(self):
+        while True:
+            try:
+                await self.archive()
+            except Exception as e:
+                print(f"logs: archive failed: {e}")
+
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self.archive_dir:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+
+log_archiver = LogArchiver(
+    os.environ.get("LOG_ARCHIVE_DIR"),
+    retention_months=int(os.environ.get("LOG_RETENTION_MONTHS", 6)),
+    interval=int(os.environ.get("LOG_ARCHIVE_INTERVAL", 3600)),
+)
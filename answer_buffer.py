@@ -0,0 +1,202 @@
+import datetime as dt
+import asyncio
+import json
+import glob
+import os
+
+import pytz
+
+from utils import db
+from scoring import store_attempts_scoring
+
+
+# an answer only replaces one given earlier, replayed journals can be stale,
+# and answers given after the attempt was closed are dropped
+UPSERT_QUERY = """
+    INSERT INTO temp_answers (attempt_id, question_id, chosen_answers, saved_dt)
+    SELECT $1, $2, $3, $4
+    FROM attempts
+    WHERE id = $1 AND (end_dt IS NULL OR end_dt >= $4)
+    ON CONFLICT (attempt_id, question_id)
+    DO UPDATE SET chosen_answers = excluded.chosen_answers, saved_dt = excluded.saved_dt
+    WHERE temp_answers.saved_dt IS NULL OR temp_answers.saved_dt <= excluded.saved_dt
+"""
+
+
+def _now():
+    return dt.datetime.now(pytz.timezone("Asia/Jakarta")).replace(tzinfo=None)
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+    return True
+
+
+class AnswerBuffer:
+    def __init__(self, interval=0.2, journal_dir=None):
+        self.interval = interval
+        self.journal_dir = journal_dir
+        self.pending = {}
+        self.journal = None
+        self.lock = asyncio.Lock()
+        self.task = None
+        self.flushed_count = 0
+
+    def _journal_path(self, suffix=""):
+        return os.path.join(self.journal_dir, f"answers-{os.getpid()}.jsonl{suffix}")
+
+    def _open_journal(self):
+        if self.journal_dir:
+            self.journal = open(self._journal_path(), "a")
+
+    def _write_journal(self, items):
+        if self.journal:
+            for (attempt_id, question_id), (chosen_answers, saved_dt) in items:
+                self.journal.write(
+                    json.dumps(
+                        [attempt_id, question_id, chosen_answers, saved_dt.isoformat()]
+                    )
+                    + "\n"
+                )
+            self.journal.flush()
+
+    def record(self, attempt_id, question_id, chosen_answers):
+        value = (list(chosen_answers), _now())
+        self.pending[(attempt_id, question_id)] = value
+        self._write_journal([((attempt_id, question_id), value)])
+
+    def pending_for(self, attempt_id):
+        return {
+            question_id: chosen_answers
+            for (pending_attempt_id, question_id), (chosen_answers, _) in self.pending.items()
+            if pending_attempt_id == attempt_id
+        }
+
+    async def flush(self):
+        async with self.lock:
+            if not self.pending:
+                return
+
+            batch = self.pending
+            self.pending = {}
+
+            flushing = None
+            if self.journal:
+                # new changes go to a fresh journal while this batch is written
+                self.journal.close()
+                flushing = self._journal_path(".flushing")
+                os.replace(self._journal_path(), flushing)
+                self._open_journal()
+
+            try:
+                await db.pool.executemany(
+                    UPSERT_QUERY,
+                    [(key[0], key[1], *value) for key, value in batch.items()],
+                )
+            except Exception:
+                restored = [
+                    (key, value) for key, value in batch.items() if key not in self.pending
+                ]
+                self.pending.update(restored)
+                self._write_journal(restored)
+                if flushing:
+                    os.remove(flushing)
+                raise
+
+            if flushing:
+                os.remove(flushing)
+            self.flushed_count += len(batch)
+
+            # attempts closed while answers given in time were still buffered get rescored
+            closed = await db.pool.fetch(
+                "SELECT id FROM attempts WHERE id = ANY($1::int[]) AND end_dt IS NOT NULL",
+                list({key[0] for key in batch}),
+            )
+            await store_attempts_scoring(row["id"] for row in closed)
+
+    async def recover(self):
+        if not self.journal_dir:
+            return
+
+        os.makedirs(self.journal_dir, exist_ok=True)
+        claimed = []
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, "answers-*.jsonl*"))):
+            pid = int(os.path.basename(path).split("-")[1].split(".")[0])
+            if pid != os.getpid() and _pid_alive(pid):
+                continue
+
+            # the rename is the claim, a worker starting alongside gets nothing
+            # and a crash here leaves the file under this pid for the next one
+            claim = self._journal_path(f".claimed-{os.urandom(4).hex()}")
+            try:
+                os.rename(path, claim)
+            except FileNotFoundError:
+                continue
+            claimed.append(claim)
+
+            # journals written before answers were timestamped count as of their mtime
+            written_dt = dt.datetime.fromtimestamp(
+                os.path.getmtime(claim), pytz.timezone("Asia/Jakarta")
+            ).replace(tzinfo=None)
+            with open(claim) as f:
+                for line in f:
+                    try:
+                        attempt_id, question_id, chosen_answers, *saved_dt = json.loads(line)
+                        saved_dt = (
+                            dt.datetime.fromisoformat(saved_dt[0]) if saved_dt else written_dt
+                        )
+                    except (TypeError, ValueError):
+                        # a torn last line from a crash
+                        continue
+                    key = (attempt_id, question_id)
+                    if key not in self.pending or self.pending[key][1] <= saved_dt:
+                        self.pending[key] = (chosen_answers, saved_dt)
+
+        self._open_journal()
+        self._write_journal(self.pending.items())
+        for claim in claimed:
+            os.remove(claim)
+        await self.flush()
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"answer buffer: {e}")
+
+    async def start(self):
+        await self.recover()
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+        await self.flush()
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+
+
+buffer_interval = os.environ.get("ANSWER_BUFFER_MS")
+answer_buffer = (
+    AnswerBuffer(
+        interval=int(buffer_interval) / 1000,
+        journal_dir=os.environ.get("ANSWER_JOURNAL_DIR"),
+    )
+    if buffer_interval
+    else None
+)
@@ -0,0 +1,345 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+import hashlib
+import asyncio
+import secrets
+import base64
+import hmac
+import time
+import jwt
+import os
+
+from fastapi import Request
+
+from utils import SECRET, db, hash_pass, encode_jwt
+
+
+SCRYPT_N = int(os.environ.get("SCRYPT_N", 2**14))
+SCRYPT_R = 8
+SCRYPT_P = 1
+
+# hashlib.scrypt releases the GIL, so a few threads keep the loop free
+kdf_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("KDF_WORKERS", os.cpu_count() or 2)),
+    thread_name_prefix="kdf",
+)
+kdf_slots = asyncio.Semaphore(int(os.environ.get("KDF_QUEUE", 64)))
+# bulk imports hash on their own threads, logins never queue behind them
+bulk_kdf_executor = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("KDF_BULK_WORKERS", 1)),
+    thread_name_prefix="kdf-bulk",
+)
+
+
+def _b64(data):
+    return base64.b64encode(data).decode()
+
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(
+        password.encode(), salt=salt, n=n, r=r, p=p, maxmem=128 * r * (n + p + 2) + 2**20
+    )
+
+
+def _hash_password(password):
+    salt = os.urandom(16)
+    key = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(key)}"
+
+
+def _verify_password(password, stored, legacy):
+    # returns (valid, needs_rehash)
+    if stored.startswith("scrypt$"):
+        _, n, r, p, salt, key = stored.split("$")
+        n, r, p = int(n), int(r), int(p)
+        valid = hmac.compare_digest(
+            _scrypt(password, base64.b64decode(salt), n, r, p), base64.b64decode(key)
+        )
+        return valid, valid and (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+    # credentials written before the KDF: proctors as sha256, students as plaintext
+    if legacy == "sha256":
+        valid = hmac.compare_digest(hash_pass(password).encode(), stored.encode())
+    else:
+        valid = hmac.compare_digest(password.encode(), stored.encode())
+
+    return valid, valid
+
+
+DUMMY_HASH = _hash_password(os.urandom(8).hex())
+
+
+async def _run_kdf(func, *args):
+    async with kdf_slots:
+        return await asyncio.get_running_loop().run_in_executor(kdf_executor, func, *args)
+
+
+async def hash_password(password):
+    return await _run_kdf(_hash_password, password)
+
+
+async def hash_passwords(passwords):
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(
+        *(loop.run_in_executor(bulk_kdf_executor, _hash_password, password) for password in passwords)
+    )
+
+
+async def verify_password(password, stored, legacy="plain"):
+    if stored is None:
+        # unknown users cost the same as known ones
+        await _run_kdf(_verify_password, password, DUMMY_HASH, legacy)
+        return False, False
+
+    return await _run_kdf(_verify_password, password, stored, legacy)
+
+
+async def authenticate(table, username, password, legacy, condition="TRUE"):
+    user = await db.pool.fetchrow(
+        f"SELECT * FROM {table} WHERE username = $1 AND {condition}", username
+    )
+    valid, needs_rehash = await verify_password(
+        password, user["pass_hash"] if user else None, legacy
+    )
+    if not valid:
+        return None
+
+    if needs_rehash:
+        await db.pool.execute(
+            f"UPDATE {table} SET pass_hash = $1 WHERE id = $2 AND pass_hash = $3",
+            await hash_password(password),
+            user["id"],
+            user["pass_hash"],
+        )
+
+    return user
+
+
+class TokenBucket:
+    def __init__(self, capacity, refill_per_second, max_keys=100000):
+        self.capacity = capacity
+        self.refill = refill_per_second
+        self.max_keys = max_keys
+        self.buckets = {}
+
+    def _tokens(self, key, now):
+        tokens, last = self.buckets.get(key, (self.capacity, now))
+        return min(self.capacity, tokens + (now - last) * self.refill)
+
+    def peek(self, key):
+        return self._tokens(key, time.monotonic()) >= 1
+
+    def take(self, key):
+        now = time.monotonic()
+        tokens = self._tokens(key, now)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+
+        self.buckets.pop(key, None)
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_keys:
+            # oldest untouched keys go first, a full bucket is the default anyway
+            del self.buckets[next(iter(self.buckets))]
+
+        return allowed
+
+
+login_per_username = TokenBucket(
+    int(os.environ.get("LOGIN_BURST_USERNAME", 5)),
+    float(os.environ.get("LOGIN_PER_MINUTE_USERNAME", 10)) / 60,
+)
+login_per_ip = TokenBucket(
+    int(os.environ.get("LOGIN_BURST_IP", 60)),
+    float(os.environ.get("LOGIN_PER_MINUTE_IP", 120)) / 60,
+)
+
+
+def _client_ip(request):
+    return request.client.host if request.client else ""
+
+
+def login_allowed(request, username):
+    # a whole school can sit behind one address, so the ip bucket only
+    # counts failed logins and a classroom signing in at once is not throttled
+    return login_per_ip.peek(_client_ip(request)) and login_per_username.take(username.lower())
+
+
+def login_failed(request):
+    login_per_ip.take(_client_ip(request))
+
+
+SESSION_COOKIE = "monde"
+REVOKE_CHANNEL = "session_revoked"
+REVOKE_NOTIFY_KEYS = 200
+
+
+class LoginRequired(Exception):
+    def __init__(self, api=False):
+        self.api = api
+
+
+class SessionStore:
+    def __init__(self, ttl=43200, rotate_after=21600, cache_size=4096, recheck=30):
+        self.ttl = ttl
+        self.rotate_after = rotate_after
+        self.cache_size = cache_size
+        # seconds a cached token is trusted before revocations are read again
+        self.recheck = recheck
+        self.cache = OrderedDict()  # token digest -> (verified payload, last revocation check)
+        self.revoked = {}  # key -> (revoked at, expires at)
+        self.listener = None
+
+    def issue(self, payload):
+        now = int(time.time())
+        claims = {k: v for k, v in payload.items() if k not in ("iat", "exp")}
+        # a rotated token keeps its session id so logging out revokes all of them
+        claims.setdefault("sid", secrets.token_hex(8))
+        return encode_jwt({**claims, "iat": now, "exp": now + self.ttl})
+
+    def _keys(self, payload):
+        return [f"sid:{payload['sid']}", f"{payload['type']}:{payload['id']}"]
+
+    def _is_revoked(self, payload):
+        return any(
+            self.revoked.get(key, (0, 0))[0] >= payload["iat"] for key in self._keys(payload)
+        )
+
+    def _remember(self, rows):
+        now = time.time()
+        self.revoked = {k: v for k, v in self.revoked.items() if v[1] > now}
+        for key, revoked_at, expires_at in rows:
+            if expires_at > now:
+                self.revoked[key] = max(self.revoked.get(key, (0, 0)), (revoked_at, expires_at))
+
+    async def _load_revoked(self, payload):
+        rows = await db.pool.fetch(
+            "SELECT key, revoked_at, expires_at FROM revoked_sessions WHERE key = ANY($1) AND expires_at > $2",
+            self._keys(payload),
+            int(time.time()),
+        )
+        self._remember([tuple(row) for row in rows])
+
+    async def decode(self, token):
+        key = hashlib.sha256(token.encode()).digest()
+        cached = self.cache.get(key)
+        if cached is None:
+            try:
+                # tokens issued before sessions expired carry no exp and are refused
+                payload = jwt.decode(
+                    token, SECRET, ["HS256"], options={"require": ["exp", "iat", "sid"]}
+                )
+            except jwt.InvalidTokenError:
+                return None
+            checked = None
+        else:
+            payload, checked = cached
+            self.cache.move_to_end(key)
+
+        if payload["exp"] <= time.time():
+            self.cache.pop(key, None)
+            return None
+
+        now = time.monotonic()
+        if checked is None or now - checked >= self.recheck:
+            # the table also covers revocations this process was never told about
+            await self._load_revoked(payload)
+            self.cache[key] = (payload, now)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        if self._is_revoked(payload):
+            return None
+
+        return payload
+
+    async def current(self, request, user_type=None):
+        token = request.cookies.get(SESSION_COOKIE)
+        payload = await self.decode(token) if token else None
+        if payload is None or (user_type and payload["type"] != user_type):
+            return None
+
+        if time.time() - payload["iat"] >= self.rotate_after and not hasattr(
+            request.state, "session_token"
+        ):
+            # the old token stays valid until it expires, requests in flight still carry it
+            request.state.session_token = self.issue(payload)
+
+        return payload
+
+    async def _revoke(self, keys):
+        now = int(time.time())
+        # no token issued before now outlives one ttl from now
+        until = now + self.ttl
+        self._remember([(key, now, until) for key in keys])
+        await db.pool.execute(
+            """
+            INSERT INTO revoked_sessions (key, revoked_at, expires_at)
+            SELECT unnest($1::varchar[]), $2, $3
+            ON CONFLICT (key) DO UPDATE
+            SET revoked_at = excluded.revoked_at, expires_at = excluded.expires_at
+            """,
+            keys,
+            now,
+            until,
+        )
+        await db.pool.execute("DELETE FROM revoked_sessions WHERE expires_at <= $1", now)
+
+        if self.listener is not None:
+            # pg_notify refuses payloads of 8000 bytes or more
+            for i in range(0, len(keys), REVOKE_NOTIFY_KEYS):
+                await db.pool.execute(
+                    "SELECT pg_notify($1, $2)",
+                    REVOKE_CHANNEL,
+                    f"{now}:{until}:{','.join(keys[i:i + REVOKE_NOTIFY_KEYS])}",
+                )
+
+    async def revoke(self, token):
+        payload = await self.decode(token)
+        if payload is not None:
+            await self._revoke([f"sid:{payload['sid']}"])
+
+    async def revoke_user(self, user_type, ids):
+        # every session of these accounts, e.g. students of an archived cohort
+        if ids:
+            await self._revoke([f"{user_type}:{user_id}" for user_id in ids])
+
+    def _on_notify(self, conn, pid, channel, payload):
+        revoked_at, until, keys = payload.split(":", 2)
+        self._remember([(key, int(revoked_at), int(until)) for key in keys.split(",")])
+
+    async def listen(self):
+        self.listener = await db.session().acquire()
+        await self.listener.add_listener(REVOKE_CHANNEL, self._on_notify)
+
+    async def unlisten(self):
+        if self.listener is not None:
+            await self.listener.remove_listener(REVOKE_CHANNEL, self._on_notify)
+            await db.session().release(self.listener)
+            self.listener = None
+
+
+sessions = SessionStore(
+    ttl=int(os.environ.get("SESSION_TTL", 12 * 3600)),
+    rotate_after=int(os.environ.get("SESSION_ROTATE_AFTER", 6 * 3600)),
+    cache_size=int(os.environ.get("SESSION_CACHE_SIZE", 4096)),
+    recheck=int(os.environ.get("SESSION_RECHECK", 30)),
+)
+
+
+def session(user_type, api=False):
+    async def dependency(request: Request):
+        payload = await sessions.current(request, user_type)
+        if payload is None:
+            raise LoginRequired(api)
+
+        return payload
+
+    return dependency
+
+
+proctor_session = session("proctor")
+student_session = session("student")
+# endpoints fetched by scripts answer 401 instead of redirecting to the login page
+proctor_api_session = session("proctor", api=True)
+student_api_session = session("student", api=True)
@@ -0,0 +1,241 @@
+from dataclasses import dataclass
+import hashlib
+from typing import Dict, FrozenSet, Optional, Tuple
+import asyncio
+import time
+import os
+
+from utils import db
+
+
+CHANNEL = "catalog_changed"
+
+
+@dataclass(frozen=True)
+class Answer:
+    id: int
+    answer_text: str
+    is_correct: bool
+
+
+@dataclass(frozen=True)
+class Question:
+    id: int
+    order: int
+    question_html: str
+    answers: Tuple[Answer, ...]
+    correct_count: int
+
+
+@dataclass(frozen=True)
+class PackSnapshot:
+    pack_id: int
+    version: int
+    questions: Tuple[Question, ...]
+    by_order: Dict[int, Question]
+    question_ids: FrozenSet[int]
+    digest: str
+
+    @property
+    def question_count(self):
+        return len(self.questions)
+
+    def get_question(self, order) -> Optional[Question]:
+        return self.by_order.get(order)
+
+
+class CatalogCache:
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.version = 0
+        self.entries = {}
+        self.loading = {}
+        self.listener = None
+
+    async def get(self, key, loader):
+        entry = self.entries.get(key)
+        if entry and entry[0] == self.version and entry[1] > time.monotonic():
+            return entry[2]
+
+        # concurrent misses on the same key share one query
+        future = self.loading.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._load(key, loader))
+            self.loading[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+
+        return await asyncio.shield(future)
+
+    def _done(self, key, future):
+        if self.loading.get(key) is future:
+            del self.loading[key]
+
+    async def _load(self, key, loader):
+        version = self.version
+        value = await loader()
+        if version == self.version:
+            self.entries[key] = (version, time.monotonic() + self.ttl, value)
+
+        return value
+
+    def clear(self):
+        self.version += 1
+        self.entries.clear()
+        self.loading.clear()
+
+    async def invalidate(self, broadcast=False):
+        self.clear()
+        # scripts run without a listener but the web processes still need to hear it
+        if self.listener is not None or broadcast:
+            await db.pool.execute("SELECT pg_notify($1, $2)", CHANNEL, str(os.getpid()))
+
+    def _on_notify(self, conn, pid, channel, payload):
+        if payload != str(os.getpid()):
+            self.clear()
+
+    async def listen(self):
+        self.listener = await db.session().acquire()
+        await self.listener.add_listener(CHANNEL, self._on_notify)
+
+    async def unlisten(self):
+        if self.listener is not None:
+            await self.listener.remove_listener(CHANNEL, self._on_notify)
+            await db.session().release(self.listener)
+            self.listener = None
+
+
+catalog = CatalogCache(ttl=int(os.environ.get("CATALOG_TTL", 60)))
+
+
+async def _load_exams():
+    return await db.pool.fetch("SELECT * FROM exams ORDER BY start_dt")
+
+
+async def _load_exam_details():
+    return await db.pool.fetch(
+        """
+        SELECT
+            e.id AS exam_id,
+            e.pack_id,
+            e.archived,
+            e.max_attempts,
+            e.show_score,
+            p.name AS pack_name,
+            m.id AS module_id,
+            m.name AS module_name,
+            e.proctor_id,
+            e.name AS exam_name,
+            e.start_dt,
+            e.end_dt,
+            e.time_limit
+        FROM
+            exams e
+        JOIN
+            packs p ON e.pack_id = p.id
+        JOIN
+            modules m ON p.module_id = m.id
+        ORDER BY
+            e.id
+    """
+    )
+
+
+async def _load_packs():
+    packs = await db.pool.fetch(
+        """
+        SELECT packs.id, packs.name, packs.module_id, COUNT(questions) AS question_count
+        FROM packs
+        LEFT JOIN questions ON packs.id = questions.pack_id
+        GROUP BY packs.id, packs.name;
+    """
+    )
+    return [dict(pack) for pack in packs]
+
+
+async def _load_modules():
+    return await db.pool.fetch("SELECT * FROM modules ORDER BY id")
+
+
+async def get_exams():
+    return await catalog.get("exams", _load_exams)
+
+
+async def get_exam_details():
+    return await catalog.get("exam_details", _load_exam_details)
+
+
+async def get_exam_detail(exam_id):
+    for exam in await get_exam_details():
+        if exam["exam_id"] == exam_id:
+            return exam
+
+    return None
+
+
+async def get_packs():
+    return await catalog.get("packs", _load_packs)
+
+
+async def get_pack(pack_id):
+    for pack in await get_packs():
+        if pack["id"] == pack_id:
+            return pack
+
+    return None
+
+
+async def _load_pack_snapshot(pack_id):
+    version = catalog.version
+    rows = await db.pool.fetch(
+        'SELECT id, "order", question_html FROM questions WHERE pack_id = $1 ORDER BY "order"',
+        pack_id,
+    )
+    answer_rows = await db.pool.fetch(
+        """
+        SELECT a.id, a.question_id, a.answer_text, a.is_correct
+        FROM answers a
+        JOIN questions q ON
+            a.question_id = q.id
+        WHERE q.pack_id = $1
+        ORDER BY a.id
+    """,
+        pack_id,
+    )
+
+    answers = {}
+    for row in answer_rows:
+        answers.setdefault(row["question_id"], []).append(
+            Answer(row["id"], row["answer_text"], row["is_correct"])
+        )
+
+    questions = tuple(
+        Question(
+            row["id"],
+            row["order"],
+            row["question_html"],
+            tuple(answers.get(row["id"], [])),
+            sum(1 for ans in answers.get(row["id"], []) if ans.is_correct),
+        )
+        for row in rows
+    )
+    return PackSnapshot(
+        pack_id,
+        version,
+        questions,
+        {question.order: question for question in questions},
+        frozenset(question.id for question in questions),
+        # unlike version this is the same in every process
+        hashlib.sha1(repr(questions).encode()).hexdigest()[:16],
+    )
+
+
+async def get_pack_snapshot(pack_id):
+    return await catalog.get(("pack_snapshot", pack_id), lambda: _load_pack_snapshot(pack_id))
+
+
+async def get_modules():
+    return await catalog.get("modules", _load_modules)
+
+
+async def invalidate_catalog(broadcast=False):
+    await catalog.invalidate(broadcast)
@@ -1,13 +1,18 @@
 from fastapi import FastAPI, Request, Form
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, JSONResponse
 from starlette.middleware.sessions import SessionMiddleware
 
-import jwt
+import os
 import datetime as dt
 from typing import List, Literal
 
-from utils import SECRET, db, templates, Database, hash_pass, encode_jwt, check_jwt
+from utils import SECRET, db, templates, Database, hash_pass, encode_jwt, log_sink, writes, WRITE_ROUTES
+from migrate import migrate
+from auth import kdf_executor, bulk_kdf_executor, sessions, LoginRequired, SESSION_COOKIE
+from catalog import catalog
+from monitor import monitor
+from activity_log import log_archiver
 from routes.siswa import student_router
 from routes.proktor import proctor_router
 
@@ -17,24 +22,69 @@ app.mount("/assets", StaticFiles(directory="./assets"), name="assets")
 app.add_middleware(SessionMiddleware, secret_key=SECRET)
 
 
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    response = await call_next(request)
+
+    # GET and HEAD only read, apart from the few routes marked as writes
+    if request.method not in ("GET", "HEAD") or request.scope.get("endpoint") in WRITE_ROUTES:
+        db.mark_write(response)
+
+    return response
+
+
+@app.middleware("http")
+async def rotate_session(request: Request, call_next):
+    response = await call_next(request)
+
+    token = getattr(request.state, "session_token", None)
+    if token:
+        response.set_cookie(SESSION_COOKIE, token)
+
+    return response
+
+
+@app.exception_handler(LoginRequired)
+async def login_required(request: Request, exc: LoginRequired):
+    if exc.api:
+        return JSONResponse({"ok": False, "error": "Tidak diizinkan"}, 401)
+
+    return RedirectResponse("/", 303)
+
+
 @app.on_event("startup")
 async def startup():
     await db.create_pool()
+    await db.warm_up()
+    if os.environ.get("MIGRATE_ON_STARTUP", "1") == "1":
+        await migrate()
+    log_sink.start()
+    log_archiver.start()
+    if os.environ.get("CATALOG_LISTEN"):
+        await catalog.listen()
+    if os.environ.get("MONITOR_LISTEN"):
+        # relays dashboard events between processes, needed with more than one worker
+        await monitor.listen()
+    if os.environ.get("SESSION_LISTEN"):
+        # without it other processes still see a revocation within SESSION_RECHECK
+        await sessions.listen()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await catalog.unlisten()
+    await sessions.unlisten()
+    await monitor.unlisten()
+    await log_archiver.stop()
+    await log_sink.stop()
+    kdf_executor.shutdown(wait=False)
+    bulk_kdf_executor.shutdown(wait=False)
 
 
 @app.get("/")
 async def root_page(request: Request):
-    jwt_str = request.cookies.get("monde")
-    if jwt_str:
-        try:
-            payload = jwt.decode(jwt_str, SECRET, ["HS256"])
-        except Exception as e:
-            request.cookies.pop("monde")
-            logged_in = False
-        else:
-            logged_in = True
-    else:
-        logged_in = False
+    payload = await sessions.current(request)
+    logged_in = payload is not None
 
     if logged_in:
         if payload["type"] == "student":
@@ -50,8 +100,20 @@ async def root_page(request: Request):
 app.include_router(student_router)
 app.include_router(proctor_router)
 
+
+@app.on_event("shutdown")
+async def close_database():
+    # registered after the routers so their shutdown handlers can still flush
+    await db.close()
+
 @app.get("/keluar")
-async def logout():
+@writes
+async def logout(request: Request):
+    token = request.cookies.get(SESSION_COOKIE)
+    if token:
+        await sessions.revoke(token)
+
     response = RedirectResponse("/")
     response.delete_cookie("monde")
+    response.delete_cookie("ujian")
     return response
@@ -0,0 +1,182 @@
+import datetime as dt
+import argparse
+import asyncio
+import json
+import glob
+import os
+
+from utils import db
+
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+LOCK_KEY = 8247
+
+
+# route query, sample arguments and the index it is expected to use
+HOT_QUERIES = [
+    (
+        "open attempt of a student",
+        "SELECT * FROM attempts WHERE student_id = $1 AND end_dt IS NULL",
+        [1],
+        "attempts_one_open_per_student_idx",
+    ),
+    (
+        "attempts of a student in an exam",
+        "SELECT COUNT(*) FROM attempts WHERE exam_id = $1 AND student_id = $2",
+        [1, 1],
+        "attempts_exam_student_idx",
+    ),
+    (
+        "attempts of a student",
+        "SELECT exam_id, COUNT(*) FROM attempts WHERE student_id = $1 GROUP BY exam_id",
+        [1],
+        "attempts_student_idx",
+    ),
+    (
+        "answers of an attempt",
+        "SELECT * FROM temp_answers WHERE attempt_id = $1",
+        [1],
+        "temp_answers_pkey",
+    ),
+    (
+        "questions of a pack",
+        'SELECT * FROM questions WHERE pack_id = $1 ORDER BY "order" LIMIT 40',
+        [1],
+        "questions_pack_order_idx",
+    ),
+    (
+        "question by order",
+        'SELECT * FROM questions WHERE pack_id = $1 AND "order" = $2',
+        [1, 1],
+        "questions_pack_order_idx",
+    ),
+    (
+        "answers of questions",
+        "SELECT * FROM answers WHERE question_id = ANY($1::int[]) ORDER BY id",
+        [[1, 2, 3]],
+        "answers_question_idx",
+    ),
+    (
+        "activity log page",
+        "SELECT * FROM logs WHERE (log_dt, id) < ($1, $2) ORDER BY log_dt DESC, id DESC LIMIT 51",
+        [dt.datetime(2100, 1, 1), 0],
+        "logs_log_dt_id_idx",
+    ),
+    (
+        "activity log of an actor",
+        "SELECT * FROM logs WHERE actor_role = $1 AND actor_id = $2 ORDER BY log_dt DESC, id DESC LIMIT 51",
+        ["student", 1],
+        "logs_actor_log_dt_id_idx",
+    ),
+]
+
+
+def migration_files():
+    files = []
+    for path in sorted(glob.glob(os.path.join(MIGRATIONS_DIR, "*.sql"))):
+        name = os.path.basename(path)[:-4]
+        files.append((int(name.split("_", 1)[0]), name, path))
+
+    return files
+
+
+async def applied_versions(conn):
+    await conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_dt TIMESTAMP NOT NULL DEFAULT now()
+        )
+    """
+    )
+    rows = await conn.fetch("SELECT version FROM schema_migrations")
+    return {row["version"] for row in rows}
+
+
+async def migrate():
+    applied = []
+    async with db.session().acquire() as conn:
+        # processes starting together wait here instead of migrating twice
+        await conn.execute("SELECT pg_advisory_lock($1)", LOCK_KEY)
+        try:
+            done = await applied_versions(conn)
+            for version, name, path in migration_files():
+                if version in done:
+                    continue
+
+                with open(path) as f:
+                    sql = f.read()
+
+                async with conn.transaction():
+                    await conn.execute(sql)
+                    await conn.execute(
+                        "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)",
+                        version,
+                        name,
+                    )
+                applied.append(name)
+                print(f"migrate: applied {name}")
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", LOCK_KEY)
+
+    return applied
+
+
+async def status():
+    async with db.session().acquire() as conn:
+        done = await applied_versions(conn)
+
+    return [(name, version in done) for version, name, _ in migration_files()]
+
+
+def _plan_indexes(plan):
+    indexes = set()
+    if "Index Name" in plan:
+        indexes.add(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        indexes |= _plan_indexes(child)
+
+    return indexes
+
+
+async def verify():
+    results = []
+    async with db.session().acquire() as conn:
+        for label, query, args, index in HOT_QUERIES:
+            async with conn.transaction():
+                # small development tables make a sequential scan the cheapest
+                # plan, this asks whether the index is usable at all
+                await conn.execute("SET LOCAL enable_seqscan = off")
+                plan = await conn.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *args)
+
+            used = _plan_indexes(json.loads(plan)[0]["Plan"])
+            results.append((label, index, index in used, sorted(used)))
+
+    return results
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Migrasi skema basis data")
+    parser.add_argument("command", nargs="?", default="up", choices=("up", "status", "verify"))
+    args = parser.parse_args()
+
+    await db.create_pool()
+
+    if args.command == "up":
+        applied = await migrate()
+        print(f"{len(applied)} migrasi diterapkan")
+    elif args.command == "status":
+        for name, done in await status():
+            print(f"[{'x' if done else ' '}] {name}")
+    else:
+        failed = 0
+        for label, index, ok, used in await verify():
+            failed += not ok
+            print(f"{'OK  ' if ok else 'FAIL'} {label}: {index} (dipakai: {', '.join(used) or '-'})")
+        if failed:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
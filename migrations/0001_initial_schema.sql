@@ -0,0 +1,81 @@
+-- Tables as the application uses them. IF NOT EXISTS keeps this a no-op on
+-- databases that were created by hand before migrations existed.
+
+CREATE TABLE IF NOT EXISTS proctors (
+    id SERIAL PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    pass_hash TEXT NOT NULL,
+    name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS students (
+    id SERIAL PRIMARY KEY,
+    username TEXT NOT NULL UNIQUE,
+    pass_hash TEXT NOT NULL,
+    name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS modules (
+    id SERIAL PRIMARY KEY,
+    name TEXT NOT NULL,
+    add_dt TIMESTAMP NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS packs (
+    id SERIAL PRIMARY KEY,
+    module_id INTEGER NOT NULL REFERENCES modules (id) ON DELETE CASCADE,
+    name TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS questions (
+    id SERIAL PRIMARY KEY,
+    pack_id INTEGER NOT NULL REFERENCES packs (id) ON DELETE CASCADE,
+    question_text TEXT NOT NULL,
+    question_html TEXT NOT NULL,
+    "order" INTEGER
+);
+
+CREATE TABLE IF NOT EXISTS answers (
+    id SERIAL PRIMARY KEY,
+    question_id INTEGER NOT NULL REFERENCES questions (id) ON DELETE CASCADE,
+    answer_text TEXT NOT NULL,
+    is_correct BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+CREATE TABLE IF NOT EXISTS exams (
+    id SERIAL PRIMARY KEY,
+    pack_id INTEGER NOT NULL REFERENCES packs (id) ON DELETE CASCADE,
+    proctor_id INTEGER REFERENCES proctors (id) ON DELETE SET NULL,
+    name TEXT NOT NULL,
+    start_dt TIMESTAMP NOT NULL,
+    end_dt TIMESTAMP,
+    time_limit INTERVAL,
+    max_attempts INTEGER NOT NULL DEFAULT 0,
+    show_score BOOLEAN NOT NULL DEFAULT FALSE,
+    archived BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+CREATE TABLE IF NOT EXISTS attempts (
+    id SERIAL PRIMARY KEY,
+    exam_id INTEGER NOT NULL REFERENCES exams (id) ON DELETE CASCADE,
+    student_id INTEGER NOT NULL REFERENCES students (id) ON DELETE CASCADE,
+    start_dt TIMESTAMP NOT NULL,
+    end_dt TIMESTAMP,
+    current_question INTEGER NOT NULL DEFAULT 1
+);
+
+CREATE TABLE IF NOT EXISTS temp_answers (
+    attempt_id INTEGER NOT NULL REFERENCES attempts (id) ON DELETE CASCADE,
+    question_id INTEGER NOT NULL REFERENCES questions (id) ON DELETE CASCADE,
+    chosen_answers INTEGER[] NOT NULL DEFAULT '{}',
+    PRIMARY KEY (attempt_id, question_id)
+);
+
+CREATE TABLE IF NOT EXISTS logs (
+    id SERIAL PRIMARY KEY,
+    actor_id INTEGER NOT NULL,
+    actor_role TEXT NOT NULL,
+    actor_name TEXT NOT NULL,
+    message TEXT NOT NULL,
+    log_dt TIMESTAMP NOT NULL
+);
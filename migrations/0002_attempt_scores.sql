@@ -0,0 +1,9 @@
+-- Previously created by scoring.create_score_table on every startup.
+
+CREATE TABLE IF NOT EXISTS attempt_scores (
+    attempt_id INTEGER PRIMARY KEY REFERENCES attempts (id) ON DELETE CASCADE,
+    corrects INTEGER NOT NULL,
+    questions INTEGER NOT NULL,
+    score DOUBLE PRECISION NOT NULL,
+    scored_dt TIMESTAMP NOT NULL
+);
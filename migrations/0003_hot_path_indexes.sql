@@ -0,0 +1,31 @@
+-- A student may only have one open attempt. Older duplicates left by the
+-- start_exam race are closed first so the unique index can be built.
+UPDATE attempts a
+SET end_dt = now() AT TIME ZONE 'Asia/Jakarta'
+WHERE a.end_dt IS NULL
+  AND EXISTS (
+      SELECT 1
+      FROM attempts newer
+      WHERE newer.student_id = a.student_id
+        AND newer.end_dt IS NULL
+        AND newer.id > a.id
+  );
+
+-- also serves every "open attempt of this student" lookup
+CREATE UNIQUE INDEX IF NOT EXISTS attempts_one_open_per_student_idx
+    ON attempts (student_id) WHERE end_dt IS NULL;
+
+CREATE INDEX IF NOT EXISTS attempts_exam_student_idx
+    ON attempts (exam_id, student_id);
+
+CREATE INDEX IF NOT EXISTS attempts_student_idx
+    ON attempts (student_id);
+
+CREATE INDEX IF NOT EXISTS questions_pack_order_idx
+    ON questions (pack_id, "order");
+
+CREATE INDEX IF NOT EXISTS answers_question_idx
+    ON answers (question_id);
+
+CREATE INDEX IF NOT EXISTS exams_pack_idx
+    ON exams (pack_id);
@@ -0,0 +1,26 @@
+-- Previously created by activity_log.create_log_indexes on every startup.
+
+CREATE INDEX IF NOT EXISTS logs_log_dt_id_idx
+    ON logs (log_dt DESC, id DESC);
+
+CREATE INDEX IF NOT EXISTS logs_actor_log_dt_id_idx
+    ON logs (actor_role, actor_id, log_dt DESC, id DESC);
+
+-- message search uses ILIKE, which only a trigram index can serve; skipped
+-- when the database user may not create the extension
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+EXCEPTION WHEN insufficient_privilege THEN
+    RAISE NOTICE 'pg_trgm not available, logs.message is not indexed';
+END
+$$;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        CREATE INDEX IF NOT EXISTS logs_message_trgm_idx
+            ON logs USING gin (message gin_trgm_ops);
+    END IF;
+END
+$$;
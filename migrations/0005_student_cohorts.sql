@@ -0,0 +1,8 @@
+-- Rosters are imported per cohort; graduated cohorts are archived instead of
+-- deleted so their attempts and scores stay available.
+
+ALTER TABLE students ADD COLUMN IF NOT EXISTS cohort TEXT;
+ALTER TABLE students ADD COLUMN IF NOT EXISTS archived BOOLEAN NOT NULL DEFAULT FALSE;
+
+CREATE INDEX IF NOT EXISTS students_cohort_idx
+    ON students (cohort);
@@ -0,0 +1,13 @@
+-- Directory search: username prefix and substring match on names.
+
+CREATE INDEX IF NOT EXISTS students_username_pattern_idx
+    ON students (username text_pattern_ops);
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        CREATE INDEX IF NOT EXISTS students_name_trgm_idx
+            ON students USING gin (name gin_trgm_ops);
+    END IF;
+END
+$$;
@@ -0,0 +1,4 @@
+-- When an answer was given, so a replayed answer journal cannot overwrite a
+-- newer answer saved through another process.
+
+ALTER TABLE temp_answers ADD COLUMN IF NOT EXISTS saved_dt TIMESTAMP;
@@ -0,0 +1,12 @@
+-- Revoked sessions outlive a restart and reach processes that missed the
+-- notification. A key is either a session ("sid:<sid>") or a whole account
+-- ("student:<id>"), and revokes every token of it issued at or before
+-- revoked_at. Times are unix seconds, like the iat and exp of the tokens.
+
+CREATE TABLE IF NOT EXISTS revoked_sessions (
+    key VARCHAR(64) PRIMARY KEY,
+    revoked_at BIGINT NOT NULL,
+    expires_at BIGINT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS revoked_sessions_expires_at_idx ON revoked_sessions (expires_at);
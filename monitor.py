@@ -0,0 +1,160 @@
+import datetime as dt
+import asyncio
+import json
+import os
+
+import pytz
+
+from utils import db
+
+
+CHANNEL = "exam_events"
+# pg_notify refuses payloads of 8000 bytes or more
+NOTIFY_LIMIT = 7000
+
+
+def _now():
+    return dt.datetime.now(pytz.timezone("Asia/Jakarta")).replace(tzinfo=None)
+
+
+def _json_default(value):
+    if isinstance(value, dt.datetime):
+        return value.isoformat()
+
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _sse(kind, data):
+    return f"event: {kind}\ndata: {json.dumps(data, default=_json_default)}\n\n"
+
+
+class ExamMonitor:
+    def __init__(self, queue_size=256, heartbeat=15, relay_interval=0.1):
+        self.queue_size = queue_size
+        self.heartbeat = heartbeat
+        self.relay_interval = relay_interval
+        self.subscribers = {}  # exam id -> set of queues
+        self.outbox = []
+        self.listener = None
+        self.task = None
+        self.published_count = 0
+        self.dropped_count = 0
+
+    def subscribe(self, exam_id):
+        queue = asyncio.Queue(self.queue_size)
+        self.subscribers.setdefault(exam_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, exam_id, queue):
+        queues = self.subscribers.get(exam_id)
+        if queues:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[exam_id]
+
+    def _dispatch(self, exam_id, kind, data):
+        for queue in self.subscribers.get(exam_id, ()):
+            try:
+                queue.put_nowait((kind, data))
+            except asyncio.QueueFull:
+                # a stalled dashboard reloads instead of holding events forever
+                self.dropped_count += 1
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(("resync", {}))
+
+    def publish(self, exam_id, kind, **data):
+        self.published_count += 1
+        self._dispatch(exam_id, kind, data)
+        if self.listener is not None:
+            self.outbox.append([exam_id, kind, data])
+
+    async def stream(self, exam_id):
+        queue = self.subscribe(exam_id)
+        try:
+            yield _sse("time", {"now": _now()})
+            while True:
+                try:
+                    kind, data = await asyncio.wait_for(queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    # doubles as a keep-alive and as the clock for remaining time
+                    yield _sse("time", {"now": _now()})
+                    continue
+
+                yield _sse(kind, data)
+        finally:
+            self.unsubscribe(exam_id, queue)
+
+    async def relay(self):
+        while True:
+            await asyncio.sleep(self.relay_interval)
+            if not self.outbox:
+                continue
+
+            events = self.outbox
+            self.outbox = []
+            # events are batched so a busy exam costs one notify per interval
+            chunk = []
+            size = 0
+            for event in events:
+                encoded = json.dumps(event, default=_json_default)
+                if chunk and size + len(encoded) > NOTIFY_LIMIT:
+                    await self._notify(chunk)
+                    chunk, size = [], 0
+                chunk.append(encoded)
+                size += len(encoded) + 1
+
+            if chunk:
+                await self._notify(chunk)
+
+    async def _notify(self, chunk):
+        try:
+            await db.pool.execute(
+                "SELECT pg_notify($1, $2)",
+                CHANNEL,
+                f"{os.getpid()}:[{','.join(chunk)}]",
+            )
+        except Exception as e:
+            print(f"monitor: relay failed: {e}")
+
+    def _on_notify(self, conn, pid, channel, payload):
+        sender, events = payload.split(":", 1)
+        if sender == str(os.getpid()):
+            return
+
+        for exam_id, kind, data in json.loads(events):
+            self._dispatch(exam_id, kind, data)
+
+    async def listen(self):
+        self.listener = await db.session().acquire()
+        await self.listener.add_listener(CHANNEL, self._on_notify)
+        self.task = asyncio.create_task(self.relay())
+
+    async def unlisten(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+        if self.listener is not None:
+            await self.listener.remove_listener(CHANNEL, self._on_notify)
+            await db.session().release(self.listener)
+            self.listener = None
+
+    def status(self):
+        return {
+            "exams": len(self.subscribers),
+            "connections": sum(len(queues) for queues in self.subscribers.values()),
+            "published": self.published_count,
+            "dropped": self.dropped_count,
+            "relaying": self.listener is not None,
+        }
+
+
+monitor = ExamMonitor(
+    queue_size=int(os.environ.get("MONITOR_QUEUE_SIZE", 256)),
+    heartbeat=int(os.environ.get("MONITOR_HEARTBEAT", 15)),
+)
@@ -0,0 +1,316 @@
+import itertools
+import argparse
+import asyncio
+import html
+import json
+import csv
+import time
+import re
+import io
+
+from utils import db
+from scoring import invalidate_pack_scoring
+from catalog import invalidate_catalog
+
+
+BATCH_SIZE = 500
+LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+FORMATS = ("csv", "jsonl", "aiken", "gift")
+
+
+class RowError(ValueError):
+    pass
+
+
+def _question(text, answers, line_no):
+    text = text.strip()
+    # text_lines replaces bytes that are not UTF-8, the row is reported instead
+    if "\ufffd" in text or any("\ufffd" in answer for answer, _ in answers):
+        raise RowError(f"baris {line_no}: bukan teks UTF-8 yang valid")
+    if not text:
+        raise RowError(f"baris {line_no}: pertanyaan kosong")
+    if len(answers) < 2:
+        raise RowError(f"baris {line_no}: minimal dua jawaban")
+    if not any(is_correct for _, is_correct in answers):
+        raise RowError(f"baris {line_no}: tidak ada jawaban benar")
+
+    return {
+        "line": line_no,
+        "text": text,
+        "html": f"<p>{html.escape(text)}</p>",
+        "answers": [(answer.strip(), is_correct) for answer, is_correct in answers],
+    }
+
+
+def parse_csv(lines):
+    # pertanyaan, benar (huruf, dipisah koma), jawaban A, jawaban B, ...
+    reader = csv.reader(lines)
+    header = True
+    for row in reader:
+        line_no = reader.line_num
+        if header:
+            header = False
+            if row and row[0].strip().lower() == "pertanyaan":
+                continue
+        if not any(cell.strip() for cell in row):
+            continue
+
+        try:
+            if len(row) < 2:
+                raise RowError(f"baris {line_no}: kolom kurang")
+            correct = {c.strip().upper() for c in row[1].split(",") if c.strip()}
+            answers = [
+                (answer, LETTERS[i] in correct)
+                for i, answer in enumerate(row[2 : 2 + len(LETTERS)])
+                if answer.strip()
+            ]
+            yield _question(row[0], answers, line_no)
+        except RowError as e:
+            yield e
+
+
+def parse_jsonl(lines):
+    # {"pertanyaan": "...", "jawaban": ["..", ".."], "benar": ["A"] atau [0]}
+    for line_no, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+
+        try:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                raise RowError(f"baris {line_no}: JSON tidak valid")
+            if not isinstance(item, dict):
+                raise RowError(f"baris {line_no}: harus berupa objek")
+
+            keys = item.get("benar", [])
+            if not isinstance(keys, list):
+                raise RowError(f"baris {line_no}: kunci jawaban harus berupa daftar")
+            correct = set()
+            for c in keys:
+                if isinstance(c, str) and len(c) == 1 and c.upper() in LETTERS:
+                    correct.add(LETTERS.index(c.upper()))
+                elif isinstance(c, int) and not isinstance(c, bool):
+                    correct.add(c)
+                else:
+                    raise RowError(f"baris {line_no}: kunci jawaban tidak valid")
+            choices = item.get("jawaban", [])
+            if not isinstance(choices, list):
+                raise RowError(f"baris {line_no}: jawaban harus berupa daftar")
+            answers = [(str(answer), i in correct) for i, answer in enumerate(choices)]
+            yield _question(str(item.get("pertanyaan", "")), answers, line_no)
+        except RowError as e:
+            yield e
+
+
+AIKEN_OPTION = re.compile(r"^([A-Z])[.)]\s+(.*)$")
+AIKEN_ANSWER = re.compile(r"^ANSWER:\s*([A-Z](\s*,\s*[A-Z])*)\s*$", re.IGNORECASE)
+
+
+def parse_aiken(lines):
+    text, options, start = [], [], None
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if start is None:
+            start = line_no
+
+        option = AIKEN_OPTION.match(line)
+        answer = AIKEN_ANSWER.match(line)
+        if answer:
+            correct = {c.strip().upper() for c in answer.group(1).split(",")}
+            try:
+                yield _question(
+                    " ".join(text),
+                    [(option_text, letter in correct) for letter, option_text in options],
+                    start,
+                )
+            except RowError as e:
+                yield e
+            text, options, start = [], [], None
+        elif option and text:
+            options.append((option.group(1), option.group(2)))
+        elif options:
+            yield RowError(f"baris {start}: baris ANSWER tidak ditemukan")
+            text, options, start = [line], [], line_no
+        else:
+            text.append(line)
+
+    if start is not None:
+        yield RowError(f"baris {start}: baris ANSWER tidak ditemukan")
+
+
+GIFT_TITLE = re.compile(r"^::.*?::")
+GIFT_CHOICE = re.compile(r"([=~])(%-?\d+(?:\.\d+)?%)?((?:\\.|[^=~\\])*)")
+
+
+def _gift_unescape(text):
+    return re.sub(r"\\(.)", r"\1", text).strip()
+
+
+def _parse_gift_block(block, line_no):
+    block = GIFT_TITLE.sub("", block.strip()).strip()
+    start, end = block.find("{"), block.rfind("}")
+    if start == -1 or end < start:
+        raise RowError(f"baris {line_no}: blok jawaban {{...}} tidak ditemukan")
+
+    answers = []
+    for kind, weight, answer in GIFT_CHOICE.findall(block[start + 1 : end]):
+        # feedback after # is not stored
+        answer = re.split(r"(?<!\\)#", answer)[0]
+        is_correct = kind == "=" or bool(weight and not weight.startswith("%-"))
+        answers.append((_gift_unescape(answer), is_correct))
+
+    return _question(_gift_unescape(block[:start] + " " + block[end + 1 :]), answers, line_no)
+
+
+def parse_gift(lines):
+    block, start = [], None
+    for line_no, line in enumerate(lines, 1):
+        if line.lstrip().startswith("//"):
+            continue
+        if not line.strip():
+            if block:
+                try:
+                    yield _parse_gift_block(" ".join(block), start)
+                except RowError as e:
+                    yield e
+            block, start = [], None
+            continue
+
+        if start is None:
+            start = line_no
+        block.append(line.strip())
+
+    if block:
+        try:
+            yield _parse_gift_block(" ".join(block), start)
+        except RowError as e:
+            yield e
+
+
+PARSERS = {
+    "csv": parse_csv,
+    "jsonl": parse_jsonl,
+    "aiken": parse_aiken,
+    "gift": parse_gift,
+}
+
+
+def detect_format(filename):
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    if extension in ("json", "jsonl", "ndjson"):
+        return "jsonl"
+    if extension == "txt":
+        return "aiken"
+    if extension in FORMATS:
+        return extension
+
+    return None
+
+
+async def _insert_batch(conn, pack_id, batch, next_order):
+    rows = await conn.fetch(
+        """
+        INSERT INTO questions (pack_id, question_text, question_html, "order")
+        SELECT $1, u.question_text, u.question_html, u.ord
+        FROM unnest($2::text[], $3::text[], $4::int[]) AS u(question_text, question_html, ord)
+        RETURNING id, "order"
+    """,
+        pack_id,
+        [q["text"] for q in batch],
+        [q["html"] for q in batch],
+        list(range(next_order, next_order + len(batch))),
+    )
+    ids = {row["order"]: row["id"] for row in rows}
+
+    await conn.copy_records_to_table(
+        "answers",
+        records=[
+            (ids[next_order + i], answer_text, is_correct)
+            for i, q in enumerate(batch)
+            for answer_text, is_correct in q["answers"]
+        ],
+        columns=["question_id", "answer_text", "is_correct"],
+    )
+
+
+def _take(items, count):
+    return list(itertools.islice(items, count))
+
+
+async def import_questions(pack_id, lines, fmt, batch_size=BATCH_SIZE):
+    started = time.monotonic()
+    imported = 0
+    errors = []
+
+    async with db.pool.acquire() as conn:
+        async with conn.transaction():
+            if not await conn.fetchval("SELECT id FROM packs WHERE id = $1 FOR UPDATE", pack_id):
+                raise LookupError(f"paket {pack_id} tidak ditemukan")
+            next_order = await conn.fetchval(
+                'SELECT COALESCE(MAX("order"), 0) + 1 FROM questions WHERE pack_id = $1',
+                pack_id,
+            )
+
+            items = PARSERS[fmt](lines)
+            while True:
+                # parsing is CPU bound, a large file would otherwise stall the loop
+                chunk = await asyncio.to_thread(_take, items, batch_size)
+                if not chunk:
+                    break
+
+                errors.extend(str(item) for item in chunk if isinstance(item, RowError))
+                batch = [item for item in chunk if not isinstance(item, RowError)]
+                if batch:
+                    await _insert_batch(conn, pack_id, batch, next_order)
+                    next_order += len(batch)
+                    imported += len(batch)
+
+    seconds = time.monotonic() - started
+    return {
+        "imported": imported,
+        "errors": errors,
+        "seconds": round(seconds, 3),
+        "per_second": round(imported / seconds, 1) if seconds else imported,
+    }
+
+
+def text_lines(binary_file, encoding="utf-8-sig"):
+    return io.TextIOWrapper(binary_file, encoding=encoding, errors="replace", newline="")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Impor soal ke sebuah paket")
+    parser.add_argument("pack_id", type=int)
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=FORMATS)
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(args.path)
+    if not fmt:
+        parser.error("format tidak dikenali, gunakan --format")
+
+    await db.create_pool()
+    if not await db.pool.fetchval("SELECT id FROM packs WHERE id = $1", args.pack_id):
+        parser.error(f"paket {args.pack_id} tidak ditemukan")
+
+    with open(args.path, "rb") as f:
+        report = await import_questions(args.pack_id, text_lines(f), fmt)
+
+    if report["imported"]:
+        # same as the web import, stored scores and cached snapshots are stale now
+        await invalidate_pack_scoring(args.pack_id)
+        await invalidate_catalog(broadcast=True)
+
+    for error in report["errors"]:
+        print(error)
+    print(
+        f"{report['imported']} soal diimpor dalam {report['seconds']} detik "
+        f"({report['per_second']} soal/detik), {len(report['errors'])} galat"
+    )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
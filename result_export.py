@@ -0,0 +1,133 @@
+import tempfile
+import asyncio
+import json
+import csv
+import io
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+from utils import db
+from scoring import SCORING_QUERY, make_score
+from catalog import get_pack_snapshot
+
+
+EXPORT_QUERY = """
+    WITH scoring AS ({scoring})
+    SELECT
+        a.id,
+        a.start_dt,
+        a.end_dt,
+        s.username,
+        s.name AS student_name,
+        sc.correct_count,
+        sc.question_count,
+        (
+            SELECT json_object_agg(ta.question_id, ta.chosen_answers)
+            FROM temp_answers ta
+            WHERE ta.attempt_id = a.id
+        ) AS chosen
+    FROM attempts a
+    LEFT JOIN students s ON
+        a.student_id = s.id
+    LEFT JOIN scoring sc ON
+        sc.attempt_id = a.id
+    WHERE a.exam_id = $1
+    ORDER BY a.id
+"""
+
+FETCH_SIZE = 200
+LETTERS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+
+
+def _answer_letters(pack):
+    letters = {}
+    for question in pack.questions:
+        for i, answer in enumerate(question.answers):
+            letters[answer.id] = LETTERS[i] if i < len(LETTERS) else str(i + 1)
+
+    return letters
+
+
+async def export_rows(exam_id, pack_id):
+    pack = await get_pack_snapshot(pack_id)
+    letters = _answer_letters(pack)
+
+    yield (
+        ["id", "username", "nama", "mulai", "selesai", "benar", "soal", "nilai"]
+        + [f"soal {question.order}" for question in pack.questions]
+    )
+
+    async with db.pool.acquire() as conn:
+        async with conn.transaction():
+            query = EXPORT_QUERY.format(
+                scoring=SCORING_QUERY.format(condition="at.exam_id = $1")
+            )
+            async for row in conn.cursor(query, exam_id, prefetch=FETCH_SIZE):
+                score = make_score(row["correct_count"] or 0, row["question_count"] or 0)
+                chosen = json.loads(row["chosen"]) if row["chosen"] else {}
+
+                yield [
+                    row["id"],
+                    row["username"],
+                    row["student_name"],
+                    row["start_dt"],
+                    row["end_dt"],
+                    score["corrects"],
+                    score["questions"],
+                    round(score["score"], 2),
+                ] + [
+                    ",".join(
+                        letters.get(answer_id, "?")
+                        for answer_id in sorted(
+                            chosen.get(str(question.id)) or [],
+                            key=lambda answer_id: letters.get(answer_id, "?"),
+                        )
+                    )
+                    for question in pack.questions
+                ]
+
+
+async def export_csv(exam_id, pack_id):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so spreadsheet programs detect UTF-8
+    yield "\ufeff"
+
+    count = 0
+    async for row in export_rows(exam_id, pack_id):
+        writer.writerow(row)
+        count += 1
+        if count % FETCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def _append_rows(sheet, rows):
+    for row in rows:
+        sheet.append(row)
+
+
+async def export_xlsx(exam_id, pack_id):
+    # write-only sheets are spooled to disk, the workbook is streamed after saving
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("Hasil")
+    rows = []
+    async for row in export_rows(exam_id, pack_id):
+        rows.append(row)
+        if len(rows) >= FETCH_SIZE:
+            # building the sheet is CPU bound, it runs beside the event loop
+            await asyncio.to_thread(_append_rows, sheet, rows)
+            rows = []
+    await asyncio.to_thread(_append_rows, sheet, rows)
+
+    with tempfile.TemporaryFile() as f:
+        await asyncio.to_thread(workbook.save, f)
+        f.seek(0)
+        while chunk := await asyncio.to_thread(f.read, 64 * 1024):
+            yield chunk
@@ -0,0 +1,161 @@
+import itertools
+import asyncio
+import csv
+import io
+import time
+import re
+
+try:
+    import openpyxl
+except ImportError:
+    openpyxl = None
+
+from utils import db
+from auth import hash_passwords, sessions
+
+
+BATCH_SIZE = 500
+FORMATS = ("csv", "xlsx")
+USERNAME = re.compile(r"[a-z0-9]+")
+
+INSERT_QUERY = """
+    INSERT INTO students (username, pass_hash, name, cohort)
+    SELECT * FROM unnest($1::text[], $2::text[], $3::text[], $4::text[])
+    ON CONFLICT (username) DO NOTHING
+    RETURNING username
+"""
+
+# only when the proctor asks for it, a typo in a roster must not take over an account
+UPSERT_QUERY = """
+    INSERT INTO students (username, pass_hash, name, cohort)
+    SELECT * FROM unnest($1::text[], $2::text[], $3::text[], $4::text[])
+    ON CONFLICT (username) DO UPDATE SET
+        pass_hash = excluded.pass_hash,
+        name = excluded.name,
+        cohort = COALESCE(excluded.cohort, students.cohort),
+        archived = FALSE
+    RETURNING id, (xmax = 0) AS inserted
+"""
+
+
+class RowError(ValueError):
+    pass
+
+
+def _student(row, line_no, seen):
+    username, password, name = (str(cell or "").strip() for cell in row[:3])
+    cohort = str(row[3]).strip() if len(row) > 3 and row[3] not in (None, "") else None
+
+    # same rule as the add student form: letters and digits, stored lowercase
+    username = username.lower()
+    if not USERNAME.fullmatch(username):
+        raise RowError(f"baris {line_no}: username tidak valid")
+    if not password:
+        raise RowError(f"baris {line_no}: password kosong")
+    if not name:
+        raise RowError(f"baris {line_no}: nama kosong")
+    if username in seen:
+        raise RowError(f"baris {line_no}: username `{username}` ganda (baris {seen[username]})")
+
+    seen[username] = line_no
+    return (username, password, name, cohort)
+
+
+def _rows_csv(binary_file):
+    reader = csv.reader(io.TextIOWrapper(binary_file, encoding="utf-8-sig", newline=""))
+    for row in reader:
+        yield reader.line_num, row
+
+
+def _rows_xlsx(binary_file):
+    workbook = openpyxl.load_workbook(binary_file, read_only=True, data_only=True)
+    try:
+        for line_no, row in enumerate(workbook.active.iter_rows(values_only=True), 1):
+            yield line_no, list(row)
+    finally:
+        workbook.close()
+
+
+def parse_roster(binary_file, fmt):
+    # username, password, nama, angkatan (optional); a header row is skipped
+    rows = _rows_xlsx(binary_file) if fmt == "xlsx" else _rows_csv(binary_file)
+    seen = {}
+    for line_no, row in rows:
+        if not any(str(cell or "").strip() for cell in row):
+            continue
+        if line_no == 1 and str(row[0] or "").strip().lower() == "username":
+            continue
+
+        try:
+            if len(row) < 3:
+                raise RowError(f"baris {line_no}: kolom kurang")
+            yield _student(row, line_no, seen)
+        except RowError as e:
+            yield e
+
+
+def detect_format(filename):
+    extension = filename.rsplit(".", 1)[-1].lower() if "." in filename else ""
+    return extension if extension in FORMATS else None
+
+
+def _take(items, count):
+    return list(itertools.islice(items, count))
+
+
+async def _import_batch(conn, batch, overwrite):
+    # returns the inserted count, ids of overwritten students and skipped usernames
+    usernames, passwords, names, cohorts = (list(column) for column in zip(*batch))
+    if not overwrite:
+        rows = await conn.fetch(INSERT_QUERY, usernames, passwords, names, cohorts)
+        inserted = {row["username"] for row in rows}
+        return len(inserted), [], [username for username in usernames if username not in inserted]
+
+    rows = await conn.fetch(UPSERT_QUERY, usernames, passwords, names, cohorts)
+    updated = [row["id"] for row in rows if not row["inserted"]]
+    return len(rows) - len(updated), updated, []
+
+
+async def import_roster(binary_file, fmt, overwrite=False, batch_size=BATCH_SIZE):
+    started = time.monotonic()
+    inserted = 0
+    updated = []
+    skipped = []
+    errors = []
+
+    # parsing and hashing happen before a connection is taken, the
+    # transaction only holds the inserts
+    batches = []
+    items = parse_roster(binary_file, fmt)
+    while True:
+        # parsing is CPU bound, a large file would otherwise stall the loop
+        chunk = await asyncio.to_thread(_take, items, batch_size)
+        if not chunk:
+            break
+
+        errors.extend(str(item) for item in chunk if isinstance(item, RowError))
+        batch = [item for item in chunk if not isinstance(item, RowError)]
+        if batch:
+            hashes = await hash_passwords([student[1] for student in batch])
+            batches.append(
+                [(username, pass_hash, name, cohort) for (username, _, name, cohort), pass_hash in zip(batch, hashes)]
+            )
+
+    async with db.pool.acquire() as conn:
+        async with conn.transaction():
+            for batch in batches:
+                counts = await _import_batch(conn, batch, overwrite)
+                inserted += counts[0]
+                updated += counts[1]
+                skipped += counts[2]
+
+    # an overwritten password must not leave the old sessions signed in
+    await sessions.revoke_user("student", updated)
+
+    return {
+        "inserted": inserted,
+        "updated": len(updated),
+        "skipped": skipped,
+        "errors": errors,
+        "seconds": round(time.monotonic() - started, 3),
+    }
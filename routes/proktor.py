@@ -1,9 +1,14 @@
-from fastapi import APIRouter, Request
-from fastapi.responses import RedirectResponse
+from fastapi import APIRouter, Request, Depends
+from urllib.parse import urlencode
+from functools import partial
 import datetime as dt
 import pytz
 
-from utils import db, templates, check_jwt
+from utils import db, templates, log_sink
+from auth import proctor_session
+from scheduler import scheduler
+from monitor import monitor
+from activity_log import fetch_logs, parse_date, log_archiver
 from routes.proktor_masuk import login_router
 from routes.proktor_modul import module_router
 from routes.proktor_modul_paket import pack_router
@@ -17,12 +22,7 @@ proctor_router = APIRouter(prefix="/proktor")
 
 
 @proctor_router.get("")
-async def proctor_page(request: Request):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
+async def proctor_page(request: Request, payload: dict = Depends(proctor_session)):
     # start
     logs = await db.pool.fetch("SELECT * FROM logs ORDER BY log_dt DESC LIMIT 6")
     return templates.TemplateResponse(
@@ -37,25 +37,102 @@ async def proctor_page(request: Request):
     )
 
 @proctor_router.get("/aktivitas")
-async def activity_page(request: Request):
-    logged_in, payload = check_jwt(request, "proctor")
+async def activity_page(
+    request: Request,
+    sebelum: str = None,
+    peran: str = None,
+    aktor: str = None,
+    dari: str = None,
+    sampai: str = None,
+    cari: str = None,
+    arsip: str = None,
+    format: str = None,
+    payload: dict = Depends(proctor_session),
+):
+    # start
+    filters = {
+        "peran": peran if peran in ("proctor", "student") else None,
+        # the form always submits aktor, blank or not a number means no filter
+        "aktor": int(aktor) if aktor and aktor.strip().isdigit() else None,
+        "dari": parse_date(dari),
+        "sampai": parse_date(sampai),
+        "cari": cari or None,
+    }
+    archive_months = log_archiver.months()
+    if arsip in archive_months:
+        # older months live in the archive files, not in the logs table
+        filters["arsip"] = arsip
+        fetch = partial(log_archiver.fetch, arsip)
+    else:
+        fetch = partial(fetch_logs, pool=db.reader(request))
+
+    logs, next_cursor = await fetch(
+        sebelum,
+        actor_role=filters["peran"],
+        actor_id=filters["aktor"],
+        date_from=filters["dari"],
+        date_to=filters["sampai"],
+        search=filters["cari"],
+    )
 
-    if not logged_in:
-        return RedirectResponse("/")
+    query = {key: value for key, value in filters.items() if value is not None}
+    next_url = None
+    if next_cursor:
+        next_url = "/proktor/aktivitas?" + urlencode({**query, "sebelum": next_cursor})
+
+    if format == "json":
+        return {
+            "logs": [
+                {
+                    "id": log["id"],
+                    "actor_id": log["actor_id"],
+                    "actor_role": log["actor_role"],
+                    "actor_name": log["actor_name"],
+                    "message": log["message"],
+                    "log_dt": log["log_dt"].isoformat(),
+                }
+                for log in logs
+            ],
+            "next": next_cursor,
+            "next_url": next_url and next_url + "&format=json",
+            "archive_months": archive_months,
+        }
 
-    # start
-    logs = await db.pool.fetch("SELECT * FROM logs ORDER BY log_dt DESC")
     return templates.TemplateResponse(
         "proktor_aktivitas.html",
         {
             "request": request,
             "proktor": payload,
             "logs": logs,
+            "filters": filters,
+            "archive_months": archive_months,
+            "next_url": next_url,
+            "first_url": "/proktor/aktivitas?" + urlencode(query) if sebelum else None,
             "humanize": humanize,
             "now": dt.datetime.now(pytz.timezone("Asia/Jakarta")).replace(tzinfo=None),
         },
     )
 
+@proctor_router.get("/penjadwal")
+async def scheduler_status(request: Request, payload: dict = Depends(proctor_session)):
+    # start
+    return scheduler.status()
+
+@proctor_router.get("/pencatat")
+async def log_sink_status(request: Request, payload: dict = Depends(proctor_session)):
+    # start
+    return log_sink.status()
+
+@proctor_router.get("/basisdata")
+async def database_status(request: Request, payload: dict = Depends(proctor_session)):
+    # start
+    return db.status()
+
+@proctor_router.get("/pemantau")
+async def monitor_status(request: Request, payload: dict = Depends(proctor_session)):
+    # start
+    return monitor.status()
+
 proctor_router.include_router(login_router)
 proctor_router.include_router(module_router)
 proctor_router.include_router(pack_router)
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, Request, Form
 from fastapi.responses import RedirectResponse
 
-from utils import db, templates, hash_pass, encode_jwt
+from utils import templates
+from auth import authenticate, login_allowed, login_failed, sessions
 
 login_router = APIRouter(prefix="/masuk")
 
@@ -17,14 +18,17 @@ async def proctor_login_page(request: Request):
 async def proctor_login(
     request: Request, username: str = Form(...), password: str = Form(...)
 ):
-    hashed = hash_pass(password)
-    proctor = await db.pool.fetchrow(
-        "SELECT * FROM proctors WHERE username = $1 AND pass_hash = $2",
-        username,
-        hashed,
-    )
+    if not login_allowed(request, username):
+        return templates.TemplateResponse(
+            "login.html",
+            {"request": request, "user_type": "proktor", "status": False, "limited": True},
+            429,
+        )
+
+    proctor = await authenticate("proctors", username, password, "sha256")
 
     if not proctor:
+        login_failed(request)
         return templates.TemplateResponse(
             "login.html", {"request": request, "user_type": "proktor", "status": False}
         )
@@ -35,7 +39,7 @@ async def proctor_login(
         "username": proctor["username"],
         "name": proctor["name"],
     }
-    encoded_jwt = encode_jwt(payload)
+    encoded_jwt = sessions.issue(payload)
 
     response = RedirectResponse("/proktor", 303)
     response.set_cookie("monde", encoded_jwt)
@@ -1,24 +1,21 @@
-from fastapi import APIRouter, Request, Form
+from fastapi import APIRouter, Request, Form, Depends
 from fastapi.responses import RedirectResponse
 
 import datetime as dt
 
 import pytz
 
-from utils import add_log, db, templates, check_jwt
+from utils import add_log, db, templates, writes
+from auth import proctor_session
+from catalog import invalidate_catalog
 
 module_router = APIRouter(prefix="/modul")
 
 
 @module_router.get("")
-async def module_page(request: Request):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
+async def module_page(request: Request, payload: dict = Depends(proctor_session)):
     # start
-    modules = await db.pool.fetch(
+    modules = await db.reader(request).fetch(
         """
         SELECT modules.id AS module_id, modules.name AS module_name, COUNT(packs.id) AS pack_count, modules.add_dt
         FROM modules
@@ -33,12 +30,9 @@ async def module_page(request: Request):
 
 
 @module_router.get("/{module_id}")
-async def each_module_page(request: Request, module_id: int):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
+async def each_module_page(
+    request: Request, module_id: int, payload: dict = Depends(proctor_session)
+):
     # start
     module = await db.pool.fetchrow("SELECT * FROM modules WHERE id = $1", module_id)
     packs = await db.pool.fetch(
@@ -59,29 +53,29 @@ async def each_module_page(request: Request, module_id: int):
 
 
 @module_router.post("/tambah")
-async def module_add(request: Request, nama_modul: str = Form(...)):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/", 303)
-
+async def module_add(
+    request: Request,
+    nama_modul: str = Form(...),
+    payload: dict = Depends(proctor_session),
+):
     await db.pool.execute(
         "INSERT INTO modules (name, add_dt) VALUES ($1, $2)",
         nama_modul,
         dt.datetime.now(pytz.timezone('Asia/Jakarta')).replace(tzinfo=None),
     )
 
+    await invalidate_catalog()
     await add_log(payload, f"Menambahkan modul baru `{nama_modul}`")
     return RedirectResponse("/proktor/modul", 303)
 
 
 @module_router.post("/{module_id}/edit")
-async def module_edit(request: Request, module_id: int, nama_modul: str = Form(...)):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
+async def module_edit(
+    request: Request,
+    module_id: int,
+    nama_modul: str = Form(...),
+    payload: dict = Depends(proctor_session),
+):
     module = await db.pool.fetchrow("SELECT * FROM modules WHERE id = $1", module_id)
     if not module:
         return RedirectResponse("/", 303)
@@ -90,38 +84,39 @@ async def module_edit(request: Request, module_id: int, nama_modul: str = Form(.
         "UPDATE modules SET name = $1 WHERE id = $2", nama_modul, module_id
     )
 
+    await invalidate_catalog()
     await add_log(payload, f"Menyunting modul `{nama_modul or module['name']}`")
     return RedirectResponse("/proktor/modul/", 303)
 
 
 @module_router.get("/{module_id}/hapus")
-async def module_delete(request: Request, module_id: int):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
+@writes
+async def module_delete(
+    request: Request, module_id: int, payload: dict = Depends(proctor_session)
+):
     module = await db.pool.fetchrow("SELECT * FROM modules WHERE id = $1", module_id)
     if not module:
         return RedirectResponse("/", 303)
     
     await db.pool.execute("DELETE FROM modules WHERE id = $1", module_id)
 
+    await invalidate_catalog()
     await add_log(payload, f"Menghapus modul `{module['name']}`")
     return RedirectResponse("/proktor/modul")
 
 
 @module_router.post("/{module_id}/tambah_paket")
-async def add_packet(request: Request, module_id: int, nama_paket: str = Form(...)):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
+async def add_packet(
+    request: Request,
+    module_id: int,
+    nama_paket: str = Form(...),
+    payload: dict = Depends(proctor_session),
+):
     await db.pool.execute(
         "INSERT INTO packs (module_id, name) VALUES ($1, $2)", module_id, nama_paket
     )
 
+    await invalidate_catalog()
     await add_log(payload, f"Menambahkan paket baru `{nama_paket}`")
     return RedirectResponse(f"/proktor/modul/{module_id}", 303)
 
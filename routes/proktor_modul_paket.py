@@ -1,20 +1,28 @@
-from fastapi import APIRouter, Request, Form
-from fastapi.responses import RedirectResponse
+from fastapi import APIRouter, Request, Form, File, UploadFile, Depends
+from fastapi.responses import RedirectResponse, JSONResponse
 
 from typing import List
 
-from utils import add_log, db, templates, check_jwt
+from utils import add_log, db, templates, writes
+from auth import proctor_session
+from scoring import invalidate_pack_scoring
+from catalog import invalidate_catalog
+from question_import import FORMATS, detect_format, import_questions, text_lines
 
 pack_router = APIRouter(prefix="")
 
 
-@pack_router.get("/modul/{module_id}/paket/{pack_id}")
-async def each_pack_page(request: Request, module_id: int, pack_id: int):
-    logged_in, payload = check_jwt(request, "proctor")
+QUESTIONS_PER_PAGE = 40
 
-    if not logged_in:
-        return RedirectResponse("/")
 
+@pack_router.get("/modul/{module_id}/paket/{pack_id}")
+async def each_pack_page(
+    request: Request,
+    module_id: int,
+    pack_id: int,
+    halaman: int = 1,
+    payload: dict = Depends(proctor_session),
+):
     # start
     module = await db.pool.fetchrow(
         "SELECT * FROM modules WHERE id = $1", module_id
@@ -22,10 +30,25 @@ async def each_pack_page(request: Request, module_id: int, pack_id: int):
     pack = await db.pool.fetchrow(
         "SELECT * FROM packs WHERE id = $1", pack_id
     )
+    question_count = await db.pool.fetchval(
+        "SELECT COUNT(*) FROM questions WHERE pack_id = $1", pack_id
+    )
+    page_count = max(1, -(-question_count // QUESTIONS_PER_PAGE))
+    halaman = max(1, min(halaman, page_count))
+
     questions = await db.pool.fetch(
-        'SELECT * FROM questions WHERE pack_id = $1 ORDER BY "order"', pack_id
+        'SELECT * FROM questions WHERE pack_id = $1 ORDER BY "order" LIMIT $2 OFFSET $3',
+        pack_id,
+        QUESTIONS_PER_PAGE,
+        (halaman - 1) * QUESTIONS_PER_PAGE,
     )
-    answers = await db.pool.fetch("SELECT * FROM answers")
+    answer_rows = await db.pool.fetch(
+        "SELECT * FROM answers WHERE question_id = ANY($1::int[]) ORDER BY id",
+        [q["id"] for q in questions],
+    )
+    answers = {}
+    for answer in answer_rows:
+        answers.setdefault(answer["question_id"], []).append(answer)
 
     return templates.TemplateResponse(
         "pack_each.html.j2",
@@ -36,19 +59,21 @@ async def each_pack_page(request: Request, module_id: int, pack_id: int):
             "pack": pack,
             "questions": questions,
             "answers": answers,
+            "question_count": question_count,
+            "page": halaman,
+            "page_count": page_count,
         },
     )
 
 
 @pack_router.post("/modul/{module_id}/paket/{pack_id}/edit")
 async def pack_edit(
-    request: Request, module_id: int, pack_id: int, nama_paket: str = Form(...)
+    request: Request,
+    module_id: int,
+    pack_id: int,
+    nama_paket: str = Form(...),
+    payload: dict = Depends(proctor_session),
 ):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
     # start
     pack = await db.pool.fetchrow("SELECT * FROM packs WHERE id = $1", pack_id)
     if not pack:
@@ -58,17 +83,19 @@ async def pack_edit(
         "UPDATE packs SET name = $1 WHERE id = $2", nama_paket, pack_id
     )
 
+    await invalidate_catalog()
     await add_log(payload, f"Menyunting paket `{nama_paket or pack['name']}`")
     return RedirectResponse(f"/proktor/modul/{module_id}/paket/{pack_id}", 303)
 
 
 @pack_router.get("/modul/{module_id}/paket/{pack_id}/hapus")
-async def pack_delete(request: Request, module_id: int, pack_id: int):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
+@writes
+async def pack_delete(
+    request: Request,
+    module_id: int,
+    pack_id: int,
+    payload: dict = Depends(proctor_session),
+):
     # start
     pack = await db.pool.fetchrow("SELECT * FROM packs WHERE id = $1", pack_id)
     if not pack:
@@ -76,6 +103,7 @@ async def pack_delete(request: Request, module_id: int, pack_id: int):
     
     await db.pool.execute("DELETE FROM packs WHERE id = $1", pack_id)
 
+    await invalidate_catalog()
     await add_log(payload, f"Menghapus paket `{pack['name']}`")
     return RedirectResponse(f"/proktor/modul/{module_id}")
 
@@ -89,12 +117,8 @@ async def add_question(
     pertanyaan_html: str = Form(...),
     jawaban: List[str] = Form(...),
     benar: List[bool] = Form(...),
+    payload: dict = Depends(proctor_session),
 ):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
     # start
     rights = []
     for x in benar:
@@ -102,28 +126,62 @@ async def add_question(
             rights.pop()
         rights.append(x)
 
-    question_id = await db.pool.fetchval(
-        "INSERT INTO questions (pack_id, question_text, question_html) VALUES ($1, $2, $3) RETURNING id",
-        pack_id,
-        pertanyaan,
-        pertanyaan_html,
-    )
-
-    await db.pool.executemany(
-        "INSERT INTO answers (question_id, answer_text, is_correct) VALUES ($1, $2, $3)",
-        zip([int(question_id)] * len(jawaban), jawaban, rights),
-    )
-    await db.pool.execute(
-        """
-        UPDATE questions
-        SET "order" = subquery.row_number
-        FROM (
-            SELECT id, row_number() OVER (PARTITION BY pack_id ORDER BY id) AS row_number
-            FROM questions
-        ) AS subquery
-        WHERE questions.id = subquery.id
-    """
-    )
+    async with db.pool.acquire() as conn:
+        async with conn.transaction():
+            # appended after the pack's last question, nothing else is renumbered
+            await conn.execute("SELECT id FROM packs WHERE id = $1 FOR UPDATE", pack_id)
+            question_id = await conn.fetchval(
+                """
+                INSERT INTO questions (pack_id, question_text, question_html, "order")
+                SELECT $1, $2, $3, COALESCE(MAX("order"), 0) + 1
+                FROM questions
+                WHERE pack_id = $1
+                RETURNING id
+            """,
+                pack_id,
+                pertanyaan,
+                pertanyaan_html,
+            )
+
+            await conn.executemany(
+                "INSERT INTO answers (question_id, answer_text, is_correct) VALUES ($1, $2, $3)",
+                zip([int(question_id)] * len(jawaban), jawaban, rights),
+            )
+
+    await invalidate_pack_scoring(pack_id)
+    await invalidate_catalog()
 
     await add_log(payload, "Menambahkan pertanyaan baru")
     return RedirectResponse(f"/proktor/modul/{module_id}/paket/{pack_id}", 303)
+
+
+@pack_router.post("/modul/{module_id}/paket/{pack_id}/impor")
+async def import_pack_questions(
+    request: Request,
+    module_id: int,
+    pack_id: int,
+    berkas: UploadFile = File(...),
+    format: str = Form(None),
+    payload: dict = Depends(proctor_session),
+):
+    # start
+    pack = await db.pool.fetchrow("SELECT * FROM packs WHERE id = $1", pack_id)
+    if not pack:
+        return JSONResponse({"error": "Paket tidak ditemukan"}, 404)
+
+    fmt = format or detect_format(berkas.filename or "")
+    if fmt not in FORMATS:
+        return JSONResponse({"error": "Format berkas tidak dikenali"}, 400)
+
+    # the upload is already spooled, lines are parsed as they are inserted
+    report = await import_questions(pack_id, text_lines(berkas.file), fmt)
+
+    if report["imported"]:
+        await invalidate_pack_scoring(pack_id)
+        await invalidate_catalog()
+
+    await add_log(
+        payload,
+        f"Mengimpor {report['imported']} pertanyaan ke paket `{pack['name']}`",
+    )
+    return JSONResponse(report)
@@ -1,13 +1,33 @@
-from fastapi import APIRouter, Request, Form
+from fastapi import APIRouter, Request, Form, Depends
 from fastapi.responses import RedirectResponse
 
 from typing import Literal, List
 
-from utils import db, templates, check_jwt, add_log
+from utils import db, add_log, writes
+from auth import proctor_session
+from scoring import invalidate_pack_scoring
+from catalog import invalidate_catalog
 
 question_router = APIRouter(prefix="")
 
 
+async def renumber_pack(conn, pack_id):
+    # closes gaps while keeping the current order, new questions go last
+    await conn.execute(
+        """
+        UPDATE questions
+        SET "order" = subquery.row_number
+        FROM (
+            SELECT id, row_number() OVER (ORDER BY "order" NULLS LAST, id) AS row_number
+            FROM questions
+            WHERE pack_id = $1
+        ) AS subquery
+        WHERE questions.id = subquery.id AND questions."order" IS DISTINCT FROM subquery.row_number
+    """,
+        pack_id,
+    )
+
+
 @question_router.post("/modul/{module_id}/paket/{pack_id}/soal/{question_id}/edit")
 async def edit_question(
     request: Request,
@@ -18,12 +38,8 @@ async def edit_question(
     pertanyaan_html: str = Form(...),
     jawaban: List[str] = Form(...),
     benar: List[bool] = Form(...),
+    payload: dict = Depends(proctor_session),
 ):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
     # start
     await db.pool.execute(
         "UPDATE questions SET question_text = $1, question_html = $2 WHERE id = $3",
@@ -42,87 +58,108 @@ async def edit_question(
         "INSERT INTO answers (question_id, answer_text, is_correct) VALUES ($1, $2, $3)",
         zip([int(question_id)] * len(jawaban), jawaban, rights),
     )
-    await db.pool.execute(
-        """
-        UPDATE questions
-        SET "order" = subquery.row_number
-        FROM (
-            SELECT id, row_number() OVER (PARTITION BY pack_id ORDER BY id) AS row_number
-            FROM questions
-        ) AS subquery
-        WHERE questions.id = subquery.id
-    """
-    )
+
+    await invalidate_pack_scoring(pack_id)
+    await invalidate_catalog()
 
     await add_log(payload, f"Menyunting pertanyaan `id: {question_id}`")
     return RedirectResponse(f"/proktor/modul/{module_id}/paket/{pack_id}", 303)
 
 
 @question_router.get("/modul/{module_id}/paket/{pack_id}/soal/{soal_id}")
+@writes
 async def swap_question(
     request: Request,
     module_id: int,
     pack_id: int,
     soal_id: int,
     direction: Literal["u", "d", "mu", "md"],
+    payload: dict = Depends(proctor_session),
 ):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
     # start
-    current_order = await db.pool.fetchval(
-        'SELECT "order" FROM questions WHERE id = $1', soal_id
-    )
-
-    if direction == "u":
-        other_order = current_order - 1
-    elif direction == "mu":
-        other_order = 1
-    elif direction == "d":
-        other_order = current_order + 1
-    elif direction == "md":
-        other_order = await db.pool.fetchval(
-            'SELECT MAX("order") as "max" FROM questions WHERE pack_id = 6'
+    await db.pool.execute(
+        """
+        WITH cur AS (
+            SELECT id, "order" FROM questions WHERE id = $1 AND pack_id = $2
+        ),
+        other AS (
+            SELECT q.id, q."order"
+            FROM questions q, cur c
+            WHERE q.pack_id = $2 AND q."order" = CASE $3
+                WHEN 'u' THEN c."order" - 1
+                WHEN 'd' THEN c."order" + 1
+                WHEN 'mu' THEN 1
+                ELSE (SELECT MAX("order") FROM questions WHERE pack_id = $2)
+            END
         )
-
-    other_id = await db.pool.fetchval(
-        'SELECT id FROM questions WHERE pack_id = $1 AND "order" = $2',
+        UPDATE questions q
+        SET "order" = CASE WHEN q.id = c.id THEN o."order" ELSE c."order" END
+        FROM cur c, other o
+        WHERE q.id IN (c.id, o.id) AND c.id <> o.id
+    """,
+        soal_id,
         pack_id,
-        other_order,
-    )
-
-    await db.pool.execute(
-        'UPDATE questions SET "order" = $1 WHERE id = $2', other_order, soal_id
-    )
-    await db.pool.execute(
-        'UPDATE questions SET "order" = $1 WHERE id = $2', current_order, other_id
+        direction,
     )
+    await invalidate_catalog()
 
     return RedirectResponse(f"/proktor/modul/{module_id}/paket/{pack_id}")
 
 
-@question_router.get("/modul/{module_id}/paket/{pack_id}/soal/{soal_id}/hapus")
-async def delete_question(request: Request, module_id: int, pack_id: int, soal_id: int):
-    logged_in, payload = check_jwt(request, "proctor")
+@question_router.post("/modul/{module_id}/paket/{pack_id}/urutkan")
+async def reorder_pack(
+    request: Request,
+    module_id: int,
+    pack_id: int,
+    urutan: List[int] = Form(...),
+    payload: dict = Depends(proctor_session),
+):
+    # start
+    async with db.pool.acquire() as conn:
+        async with conn.transaction():
+            question_ids = await conn.fetch(
+                "SELECT id FROM questions WHERE pack_id = $1 FOR UPDATE", pack_id
+            )
+            if len(urutan) != len(set(urutan)) or set(urutan) != {
+                row["id"] for row in question_ids
+            }:
+                return RedirectResponse(f"/proktor/modul/{module_id}/paket/{pack_id}", 303)
+
+            await conn.execute(
+                """
+                UPDATE questions q
+                SET "order" = u.ord
+                FROM unnest($2::int[]) WITH ORDINALITY AS u(id, ord)
+                WHERE q.id = u.id AND q.pack_id = $1
+            """,
+                pack_id,
+                urutan,
+            )
+    await invalidate_catalog()
+
+    await add_log(payload, f"Mengurutkan ulang soal paket `id: {pack_id}`")
+    return RedirectResponse(f"/proktor/modul/{module_id}/paket/{pack_id}", 303)
 
-    if not logged_in:
-        return RedirectResponse("/")
 
+@question_router.get("/modul/{module_id}/paket/{pack_id}/soal/{soal_id}/hapus")
+@writes
+async def delete_question(
+    request: Request,
+    module_id: int,
+    pack_id: int,
+    soal_id: int,
+    payload: dict = Depends(proctor_session),
+):
     # start
-    await db.pool.execute("DELETE FROM questions WHERE id = $1", soal_id)
-    await db.pool.execute(
-        """
-        UPDATE questions
-        SET "order" = subquery.row_number
-        FROM (
-            SELECT id, row_number() OVER (PARTITION BY pack_id ORDER BY id) AS row_number
-            FROM questions
-        ) AS subquery
-        WHERE questions.id = subquery.id
-    """
-    )
+    async with db.pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(
+                "DELETE FROM questions WHERE id = $1 AND pack_id = $2", soal_id, pack_id
+            )
+            await renumber_pack(conn, pack_id)
+
+    await invalidate_pack_scoring(pack_id)
+    await invalidate_catalog()
 
     await add_log(payload, f"Menghapus pertanyaan `id: {soal_id}`")
     return RedirectResponse(f"/proktor/modul/{module_id}/paket/{pack_id}")
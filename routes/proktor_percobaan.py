@@ -1,20 +1,20 @@
-from fastapi import APIRouter, Request
-from fastapi.responses import RedirectResponse
+from fastapi import APIRouter, Request, Depends
+from fastapi.responses import RedirectResponse, StreamingResponse, JSONResponse
 
-from routes.siswa import get_attempt_scoring
+from scoring import get_exam_scoring
+from catalog import get_pack_snapshot
+from answer_buffer import answer_buffer
+from result_export import export_csv, export_xlsx, openpyxl
+from monitor import monitor
 
-from utils import check_jwt, db, templates
+from utils import db, templates, get_ends_at
+from auth import proctor_session
 
 attempt_router = APIRouter(prefix="/percobaan")
 
 
 @attempt_router.get("/")
-async def attempt_page(request: Request):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
+async def attempt_page(request: Request, payload: dict = Depends(proctor_session)):
     # start
     exams = await db.pool.fetch(
         "SELECT e.id, e.name, e.archived, COUNT(a.id) AS attempts_count FROM exams e LEFT JOIN attempts a ON a.exam_id = e.id GROUP BY e.id ORDER BY id"
@@ -27,15 +27,16 @@ async def attempt_page(request: Request):
 
 
 @attempt_router.get("/{exam_id}")
-async def each_attempt_page(request: Request, exam_id: int):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
+async def each_attempt_page(
+    request: Request, exam_id: int, payload: dict = Depends(proctor_session)
+):
     # start
-    exam = await db.pool.fetchrow("SELECT * FROM exams WHERE id = $1", exam_id)
-    attempts = await db.pool.fetch(
+    pool = db.reader(request)
+    exam = await pool.fetchrow("SELECT * FROM exams WHERE id = $1", exam_id)
+    if not exam:
+        return RedirectResponse("/proktor/percobaan", 303)
+
+    attempts = await pool.fetch(
         """
         SELECT 
             a.id,
@@ -52,7 +53,11 @@ async def each_attempt_page(request: Request, exam_id: int):
             e.start_dt AS exam_start_dt,
             e.end_dt AS exam_end_dt,
             e.time_limit,
-            p.name AS pack_name
+            p.name AS pack_name,
+            ARRAY(
+                SELECT t.question_id FROM temp_answers t
+                WHERE t.attempt_id = a.id AND cardinality(t.chosen_answers) > 0
+            ) AS answered
         FROM attempts a
         LEFT JOIN exams e ON
             a.exam_id = e.id
@@ -64,24 +69,82 @@ async def each_attempt_page(request: Request, exam_id: int):
     """,
         exam_id,
     )
-    packs = await db.pool.fetch(
-        """
-            SELECT packs.id, packs.name, packs.module_id, COUNT(questions) AS question_count
-            FROM packs
-            LEFT JOIN questions ON packs.id = questions.pack_id
-            GROUP BY packs.id, packs.name;                            
-        """
-    )
-
-    scores = {}
+    scores = await get_exam_scoring(exam_id, pool)
+    pack = await get_pack_snapshot(exam["pack_id"])
+    # open attempts seed the live view, later changes arrive over /pantau
+    ends_at = {}
+    answered = {}
     for a in attempts:
-        for p in packs:
-            if a["pack_id"] == p["id"]:
-                scores[a["id"]] = await get_attempt_scoring(
-                    a["id"], p["question_count"]
-                )
+        if a["end_dt"]:
+            continue
+
+        ends_at[a["id"]] = get_ends_at(
+            a["start_dt"], a["time_limit"], a["exam_start_dt"], a["exam_end_dt"]
+        )
+        answered[a["id"]] = set(a["answered"])
+        if answer_buffer:
+            for question_id, chosen_answers in answer_buffer.pending_for(a["id"]).items():
+                if chosen_answers:
+                    answered[a["id"]].add(question_id)
+                else:
+                    answered[a["id"]].discard(question_id)
 
     return templates.TemplateResponse(
         "proktor_percobaan_each.html",
-        {"request": request, "proktor": payload, "exam": exam, "attempts": attempts, "scores": scores},
+        {
+            "request": request,
+            "proktor": payload,
+            "exam": exam,
+            "attempts": attempts,
+            "scores": scores,
+            "ends_at": ends_at,
+            "answered": {k: sorted(v) for k, v in answered.items()},
+            "question_count": pack.question_count,
+            "xlsx": openpyxl is not None,
+        },
+    )
+
+
+@attempt_router.get("/{exam_id}/pantau")
+async def monitor_attempts(
+    request: Request, exam_id: int, payload: dict = Depends(proctor_session)
+):
+    # start
+    return StreamingResponse(
+        monitor.stream(exam_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@attempt_router.get("/{exam_id}/ekspor")
+async def export_attempts(
+    request: Request,
+    exam_id: int,
+    format: str = "csv",
+    payload: dict = Depends(proctor_session),
+):
+    # start
+    exam = await db.pool.fetchrow("SELECT * FROM exams WHERE id = $1", exam_id)
+    if not exam:
+        return RedirectResponse("/proktor/percobaan", 303)
+
+    if answer_buffer:
+        await answer_buffer.flush()
+
+    filename = f"hasil-ujian-{exam_id}"
+    if format == "xlsx":
+        if openpyxl is None:
+            return JSONResponse({"error": "Ekspor XLSX membutuhkan openpyxl"}, 501)
+
+        return StreamingResponse(
+            export_xlsx(exam_id, exam["pack_id"]),
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.xlsx"'},
+        )
+
+    return StreamingResponse(
+        export_csv(exam_id, exam["pack_id"]),
+        media_type="text/csv; charset=utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{filename}.csv"'},
     )
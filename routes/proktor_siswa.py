@@ -1,45 +1,128 @@
-from fastapi import APIRouter, Request, Form
-from fastapi.responses import RedirectResponse
+from fastapi import APIRouter, Request, Form, File, UploadFile, Depends
+from fastapi.responses import RedirectResponse, JSONResponse
 
-from utils import add_log, db, templates, check_jwt
+from typing import List
+
+from utils import add_log, db, templates, writes
+from roster_import import detect_format, import_roster, openpyxl
+from auth import hash_password, proctor_session, proctor_api_session, sessions
 
 student_router = APIRouter(prefix="/siswa")
 
 
-@student_router.get("")
-async def student(request: Request):
-    logged_in, payload = check_jwt(request, "proctor")
+STUDENTS_PER_PAGE = 50
+# credentials never leave the database
+STUDENT_COLUMNS = "id, username, name, cohort, archived"
+
+
+def _escape_like(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _student_filter(search=None, cohort=None, archived=False):
+    conditions = ["archived = $1"]
+    args = [archived]
+    if search:
+        # the username prefix and the name substring each have their own index
+        args.append(_escape_like(search.lower()) + "%")
+        args.append("%" + _escape_like(search) + "%")
+        conditions.append(f"(username LIKE ${len(args) - 1} OR name ILIKE ${len(args)})")
+    if cohort:
+        args.append(cohort)
+        conditions.append(f"cohort = ${len(args)}")
+
+    return " AND ".join(conditions), args
 
-    if not logged_in:
-        return RedirectResponse("/")
 
+async def count_students(where, args):
+    return await db.pool.fetchval(f"SELECT COUNT(*) FROM students WHERE {where}", *args)
+
+
+async def fetch_students(where, args, offset=0, limit=STUDENTS_PER_PAGE):
+    return await db.pool.fetch(
+        f"SELECT {STUDENT_COLUMNS} FROM students WHERE {where} ORDER BY id LIMIT ${len(args) + 1} OFFSET ${len(args) + 2}",
+        *args,
+        limit,
+        offset,
+    )
+
+
+@student_router.get("")
+async def student(
+    request: Request,
+    halaman: int = 1,
+    cari: str = None,
+    angkatan: str = None,
+    arsip: bool = False,
+    payload: dict = Depends(proctor_session),
+):
     # start
-    students = await db.pool.fetch("SELECT * FROM students")
+    where, args = _student_filter(cari, angkatan, arsip)
+    total = await count_students(where, args)
+    page_count = max(1, -(-total // STUDENTS_PER_PAGE))
+    halaman = max(1, min(halaman, page_count))
+    students = await fetch_students(where, args, (halaman - 1) * STUDENTS_PER_PAGE)
 
     return templates.TemplateResponse(
         "siswa_proktor.html",
-        {"request": request, "proktor": payload, "students": students},
+        {
+            "request": request,
+            "proktor": payload,
+            "students": students,
+            "total": total,
+            "page": halaman,
+            "page_count": page_count,
+            "filters": {"cari": cari or "", "angkatan": angkatan or "", "arsip": arsip},
+            "xlsx": openpyxl is not None,
+        },
     )
 
 
+@student_router.get("/data")
+async def student_data(request: Request, payload: dict = Depends(proctor_api_session)):
+    # start
+    params = request.query_params  # DataTables server-side parameters
+    try:
+        draw = int(params.get("draw", 0))
+        start = int(params.get("start", 0))
+        length = int(params.get("length", STUDENTS_PER_PAGE))
+    except ValueError:
+        return JSONResponse({"error": "Parameter tidak valid"}, 400)
+    if start < 0 or not 1 <= length <= 500:
+        return JSONResponse({"error": "Parameter tidak valid"}, 400)
+
+    cohort = params.get("angkatan")
+    archived = params.get("arsip") in ("1", "true")
+    # recordsTotal is the table before the search box, recordsFiltered after it
+    total = await count_students(*_student_filter(None, cohort, archived))
+    where, args = _student_filter(
+        params.get("search[value]") or params.get("cari"), cohort, archived
+    )
+    filtered = await count_students(where, args)
+    students = await fetch_students(where, args, start, length)
+
+    return {
+        "draw": draw,
+        "recordsTotal": total,
+        "recordsFiltered": filtered,
+        "data": [dict(student) for student in students],
+    }
+
+
 @student_router.post("/tambah")
 async def add_student(
     request: Request,
     username_siswa: str = Form(...),
     pass_siswa: str = Form(...),
     nama_siswa: str = Form(...),
+    payload: dict = Depends(proctor_session),
 ):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
     # start
     username_siswa = username_siswa.lower()
     await db.pool.execute(
         "INSERT INTO students (username, pass_hash, name) VALUES ($1, $2, $3)",
         username_siswa,
-        pass_siswa,
+        await hash_password(pass_siswa),
         nama_siswa,
     )
 
@@ -47,29 +130,106 @@ async def add_student(
     return RedirectResponse("/proktor/siswa", 303)
 
 
+@student_router.post("/impor")
+async def import_students(
+    request: Request,
+    berkas: UploadFile = File(...),
+    format: str = Form(None),
+    timpa: bool = Form(False),
+    payload: dict = Depends(proctor_session),
+):
+    # start
+    fmt = format or detect_format(berkas.filename or "")
+    if fmt is None:
+        return JSONResponse({"error": "Format berkas tidak dikenali"}, 400)
+    if fmt == "xlsx" and openpyxl is None:
+        return JSONResponse({"error": "Impor XLSX membutuhkan openpyxl"}, 501)
+
+    report = await import_roster(berkas.file, fmt, overwrite=timpa)
+
+    await add_log(
+        payload,
+        f"Mengimpor siswa: {report['inserted']} baru, {report['updated']} ditimpa, "
+        f"{len(report['skipped'])} dilewati, {len(report['errors'])} galat",
+    )
+    return JSONResponse(report)
+
+
+def _selected_students(siswa, angkatan):
+    if siswa:
+        return "id = ANY($1::int[])", siswa
+    if angkatan:
+        return "cohort = $1", angkatan
+
+    return None, None
+
+
+@student_router.post("/arsipkan")
+async def archive_students(
+    request: Request,
+    siswa: List[int] = Form(None),
+    angkatan: str = Form(None),
+    payload: dict = Depends(proctor_session),
+):
+    # start
+    condition, arg = _selected_students(siswa, angkatan)
+    if condition:
+        archived = await db.pool.fetch(
+            f"UPDATE students SET archived = TRUE WHERE {condition} AND NOT archived RETURNING id",
+            arg,
+        )
+        await add_log(
+            payload,
+            f"Mengarsipkan {len(archived)} siswa" + (f" angkatan `{angkatan}`" if not siswa else ""),
+        )
+        # archived students cannot sign in, the ones still signed in are signed out
+        await sessions.revoke_user("student", [row["id"] for row in archived])
+
+    return RedirectResponse("/proktor/siswa", 303)
+
+
+@student_router.post("/hapus")
+async def delete_students(
+    request: Request,
+    siswa: List[int] = Form(None),
+    angkatan: str = Form(None),
+    payload: dict = Depends(proctor_session),
+):
+    # start
+    condition, arg = _selected_students(siswa, angkatan)
+    if condition:
+        deleted = await db.pool.fetch(
+            f"DELETE FROM students WHERE {condition} RETURNING id", arg
+        )
+        await add_log(
+            payload,
+            f"Menghapus {len(deleted)} siswa" + (f" angkatan `{angkatan}`" if not siswa else ""),
+        )
+        await sessions.revoke_user("student", [row["id"] for row in deleted])
+
+    return RedirectResponse("/proktor/siswa", 303)
+
+
 @student_router.post("/{student_id}/edit")
 async def edit_student(
     request: Request,
     student_id: int,
     username_siswa: str = Form(...),
-    pass_siswa: str = Form(...),
+    pass_siswa: str = Form(""),
     nama_siswa: str = Form(...),
+    payload: dict = Depends(proctor_session),
 ):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
     # start
     student = await db.pool.fetchrow("SELECT * FROM students WHERE id = $1", student_id)
     if not student:
         return RedirectResponse("/", 303)
 
     username_siswa = username_siswa.lower()
+    # the directory no longer shows passwords, an empty field keeps the current one
     await db.pool.execute(
-        "UPDATE students SET username = $1, pass_hash = $2, name = $3 WHERE id = $4",
+        "UPDATE students SET username = $1, pass_hash = COALESCE($2, pass_hash), name = $3 WHERE id = $4",
         username_siswa,
-        pass_siswa,
+        await hash_password(pass_siswa) if pass_siswa else None,
         nama_siswa,
         student_id,
     )
@@ -79,12 +239,10 @@ async def edit_student(
 
 
 @student_router.get("/{student_id}/hapus")
-async def delete_student(request: Request, student_id: int):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
+@writes
+async def delete_student(
+    request: Request, student_id: int, payload: dict = Depends(proctor_session)
+):
     # start
     student = await db.pool.fetchrow("SELECT * FROM students WHERE id = $1", student_id)
     if not student:
@@ -93,6 +251,7 @@ async def delete_student(request: Request, student_id: int):
     await db.pool.execute(
         "DELETE FROM students WHERE id = $1", student_id
     )
+    await sessions.revoke_user("student", [student_id])
 
     await add_log(payload, f"Menghapus siswa `{student['name']}`")
     return RedirectResponse("/proktor/siswa")
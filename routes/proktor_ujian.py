@@ -1,58 +1,23 @@
-from fastapi import APIRouter, Request, Form
+from fastapi import APIRouter, Request, Form, Depends
 from fastapi.responses import RedirectResponse
 
 import datetime as dt
 
-from utils import add_log, db, templates, check_jwt
+from utils import add_log, db, templates, writes
+from auth import proctor_session
+from scoring import invalidate_exam_scoring
+from scheduler import scheduler
+from catalog import get_exam_details, get_modules, get_packs, invalidate_catalog
 
 exam_router = APIRouter(prefix="/ujian")
 
 
 @exam_router.get("")
-async def exam_page(request: Request):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
+async def exam_page(request: Request, payload: dict = Depends(proctor_session)):
     # start
-    exams = await db.pool.fetch(
-        """
-        SELECT
-            e.id AS exam_id,
-            e.pack_id,
-            e.archived,
-            e.max_attempts,
-            e.show_score,
-            p.name AS pack_name,
-            m.id AS module_id,
-            m.name AS module_name,
-            e.proctor_id,
-            e.name AS exam_name,
-            e.start_dt,
-            e.end_dt,
-            e.time_limit
-        FROM
-            exams e
-        JOIN
-            packs p ON e.pack_id = p.id
-        JOIN
-            modules m ON p.module_id = m.id
-        ORDER BY
-            e.id
-    """
-    )
-
-    modules = await db.pool.fetch("SELECT * FROM modules ORDER BY id")
-    packs = await db.pool.fetch(
-        """
-        SELECT packs.id, packs.name, packs.module_id, COUNT(questions) AS question_count
-        FROM packs
-        LEFT JOIN questions ON packs.id = questions.pack_id
-        GROUP BY packs.id, packs.name;                            
-    """
-    )
-    packs = [dict(pack) for pack in packs]
+    exams = await get_exam_details()
+    modules = await get_modules()
+    packs = await get_packs()
 
     return templates.TemplateResponse(
         "proktor_ujian.html",
@@ -79,12 +44,8 @@ async def exam_add(
     hour: int = Form(None),
     minute: int = Form(None),
     second: int = Form(None),
+    payload: dict = Depends(proctor_session),
 ):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
     # start
     if not (day or hour or minute or second):
         time_limit = None
@@ -103,6 +64,7 @@ async def exam_add(
         show_score
     )
 
+    await invalidate_catalog()
     await add_log(payload, f"Menambahkan ujian baru `{exam_name}`")
     return RedirectResponse("/proktor/ujian", 303)
 
@@ -121,12 +83,8 @@ async def exam_edit(
     hour: int = Form(None),
     minute: int = Form(None),
     second: int = Form(None),
+    payload: dict = Depends(proctor_session),
 ):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
     # start
     exam = await db.pool.fetchrow("SELECT * FROM exams WHERE id = $1", exam_id)
     if not exam:
@@ -148,36 +106,38 @@ async def exam_edit(
         show_score,
         exam_id,
     )
+    if pack_id != exam["pack_id"]:
+        await invalidate_exam_scoring(exam_id)
+    await scheduler.reschedule_exam(exam_id)
 
+    await invalidate_catalog()
     await add_log(payload, f"Menyunting ujian `{exam_name or exam['name']}`")
     return RedirectResponse("/proktor/ujian", 303)
 
 @exam_router.get("/{exam_id}/arsip")
-async def exam_archive(request: Request, exam_id: int):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
+@writes
+async def exam_archive(
+    request: Request, exam_id: int, payload: dict = Depends(proctor_session)
+):
     # start
     exam = await db.pool.fetchrow("SELECT * FROM exams WHERE id = $1", exam_id)
 
     if exam["archived"]:
         await db.pool.execute("UPDATE exams SET archived = false WHERE id = $1", exam_id)
+        await invalidate_catalog()
         await add_log(payload, f"Mengeluarkan dari arsip ujian `{exam['name']}`")
     else:
         await db.pool.execute("UPDATE exams SET archived = true WHERE id = $1", exam_id)
+        await invalidate_catalog()
         await add_log(payload, f"Mengarsip ujian `{exam['name']}`")
 
     return RedirectResponse("/proktor/ujian")
 
 @exam_router.get("/{exam_id}/hapus")
-async def exam_delete(request: Request, exam_id: int):
-    logged_in, payload = check_jwt(request, "proctor")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
+@writes
+async def exam_delete(
+    request: Request, exam_id: int, payload: dict = Depends(proctor_session)
+):
     # start
     exam = await db.pool.fetchrow("SELECT * FROM exams WHERE id = $1", exam_id)
     if not exam:
@@ -185,5 +145,6 @@ async def exam_delete(request: Request, exam_id: int):
 
     await db.pool.execute("DELETE FROM exams WHERE id = $1", exam_id)
 
+    await invalidate_catalog()
     await add_log(payload, f"Menghapus ujian `{exam['name']}`")
     return RedirectResponse("/proktor/ujian")
@@ -1,12 +1,33 @@
-from fastapi import APIRouter, Request, Form
-from fastapi.responses import RedirectResponse
-
-from utils import add_log, db, templates, check_jwt, worker
+from fastapi import APIRouter, Request, Form, Depends
+from fastapi.responses import RedirectResponse, JSONResponse
+
+from utils import (
+    add_log,
+    db,
+    templates,
+    get_ends_at,
+    encode_attempt_token,
+    decode_attempt_token,
+    writes,
+)
+from auth import sessions, student_session, student_api_session
+from scheduler import scheduler
+from monitor import monitor
+from catalog import (
+    get_exams,
+    get_exam_details,
+    get_exam_detail,
+    get_packs,
+    get_pack,
+    get_pack_snapshot,
+)
+from scoring import get_attempts_scoring, store_attempts_scoring
+from answer_buffer import answer_buffer
 from routes.siswa_masuk import login_router
 
 from typing import List
 import datetime as dt
-import asyncio
+import asyncpg
 import pytz
 
 student_router = APIRouter(prefix="/siswa")
@@ -14,11 +35,20 @@ student_router = APIRouter(prefix="/siswa")
 
 @student_router.on_event("startup")
 async def startup_event():
-    asyncio.create_task(worker())
+    if answer_buffer:
+        await answer_buffer.start()
+    scheduler.start()
+
+
+@student_router.on_event("shutdown")
+async def shutdown_event():
+    await scheduler.stop()
+    if answer_buffer:
+        await answer_buffer.stop()
 
 
-async def get_attempt(student_id):
-    return await db.pool.fetchrow(
+async def get_attempt(student_id, pool=None):
+    return await (pool or db.pool).fetchrow(
         """
         SELECT 
             a.id,
@@ -46,8 +76,117 @@ async def get_attempt(student_id):
     )
 
 
-async def get_all_user_attempt(student_id):
-    return await db.pool.fetch(
+def attempt_from_exam(exam, attempt_id, student_id, start_dt, current_question):
+    return {
+        "id": attempt_id,
+        "student_id": student_id,
+        "start_dt": start_dt,
+        "end_dt": None,
+        "current_question": current_question,
+        "max_attempts": exam["max_attempts"],
+        "exam_id": exam["exam_id"],
+        "exam_name": exam["exam_name"],
+        "pack_id": exam["pack_id"],
+        "proctor_id": exam["proctor_id"],
+        "exam_start_dt": exam["start_dt"],
+        "exam_end_dt": exam["end_dt"],
+        "time_limit": exam["time_limit"],
+        "pack_name": exam["pack_name"],
+    }
+
+
+class AttemptContext:
+    def __init__(self, payload, attempt, pack, from_token=False):
+        self.payload = payload
+        self.pack = pack
+        self.attempt = dict(attempt)
+        self.from_token = from_token
+
+        # a pack edited mid-exam can leave current_question out of range
+        current_question = self.attempt["current_question"]
+        if current_question > pack.question_count:
+            current_question = pack.question_count
+        if current_question < 1:
+            current_question = 1
+        self.attempt["current_question"] = current_question
+
+        self.question = pack.get_question(current_question)
+        self.ends_at = get_ends_at(
+            attempt["start_dt"],
+            attempt["time_limit"],
+            attempt["exam_start_dt"],
+            attempt["exam_end_dt"],
+        )
+
+    def clamp(self, question_no):
+        return max(1, min(question_no, self.pack.question_count))
+
+    def set_token(self, response, current_question=None):
+        attempt = self.attempt
+        if current_question is not None:
+            attempt = dict(attempt, current_question=current_question)
+
+        response.set_cookie(
+            "ujian", encode_attempt_token(attempt, self.pack.digest, self.ends_at)
+        )
+        return response
+
+
+async def _context_from_token(request, payload):
+    token = decode_attempt_token(request, payload["id"])
+    if not token:
+        return None
+
+    now = dt.datetime.now(pytz.timezone("Asia/Jakarta")).replace(tzinfo=None)
+    if token["ends_at"] and token["ends_at"] <= now:
+        return None
+
+    exam = await get_exam_detail(token["exam_id"])
+    if not exam or exam["pack_id"] != token["pack_id"]:
+        return None
+
+    # a proctor who shortened or ended the exam invalidated the catalog entry,
+    # the recomputed deadline no longer matches the one the token was issued with
+    ends_at = get_ends_at(token["start_dt"], exam["time_limit"], exam["start_dt"], exam["end_dt"])
+    if ends_at != token["ends_at"]:
+        return None
+
+    pack = await get_pack_snapshot(token["pack_id"])
+    if pack.digest != token["pack_digest"]:
+        return None
+
+    attempt = attempt_from_exam(
+        exam,
+        token["id"],
+        payload["id"],
+        token["start_dt"],
+        token["current_question"],
+    )
+    return AttemptContext(payload, attempt, pack, from_token=True)
+
+
+async def attempt_context(request: Request):
+    if hasattr(request.state, "attempt_context"):
+        return request.state.attempt_context
+
+    context = None
+    payload = await sessions.current(request, "student")
+    if payload:
+        # the signed attempt cookie saves the attempts lookup until it goes stale
+        context = await _context_from_token(request, payload)
+
+    if payload and not context:
+        attempt = await get_attempt(payload["id"])
+        if attempt:
+            pack = await get_pack_snapshot(attempt["pack_id"])
+            context = AttemptContext(payload, attempt, pack)
+
+    request.state.attempt_context = context
+    return context
+
+
+async def get_all_user_attempt(student_id, pool=None):
+    return await (pool or db.pool).fetch(
         """
         SELECT 
             a.id,
@@ -83,55 +222,15 @@ async def get_temp_ans(attempt_id):
     temp_ans = await db.pool.fetch(
         "SELECT * FROM temp_answers WHERE attempt_id = $1", attempt_id
     )
-    return {tmp["question_id"]: tmp["chosen_answers"] for tmp in temp_ans}
-
+    temp_ans = {tmp["question_id"]: tmp["chosen_answers"] for tmp in temp_ans}
+    if answer_buffer:
+        temp_ans.update(answer_buffer.pending_for(attempt_id))
 
-async def get_attempt_scoring(attempt_id, total_questions):
-    rows = await db.pool.fetch(
-        """
-        SELECT
-            ta.question_id,
-            COUNT(*) FILTER (WHERE a.is_correct AND a.id = ANY(ta.chosen_answers)) AS chosen_correct_count,
-            COUNT(*) FILTER (WHERE a.is_correct) AS total_correct_count,
-            COUNT(*) FILTER (WHERE NOT a.is_correct AND a.id = ANY(ta.chosen_answers)) AS chosen_incorrect_count
-        FROM
-            temp_answers ta
-            INNER JOIN answers a ON ta.question_id = a.question_id
-        WHERE
-            ta.attempt_id = $1
-        GROUP BY
-            ta.question_id
-    """,
-        attempt_id,
-    )
-
-    correct_questions = 0
-    for row in rows:
-        chosen_correct_count = row["chosen_correct_count"]
-        total_correct_count = row["total_correct_count"]
-        chosen_incorrect_count = row["chosen_incorrect_count"]
-        if total_correct_count == 1:
-            if chosen_correct_count == 1 and chosen_incorrect_count == 0:
-                correct_questions += 1
-        else:
-            if (
-                chosen_correct_count == total_correct_count
-                and chosen_incorrect_count == 0
-            ):
-                correct_questions += 1
-
-    score_percentage = (
-        (correct_questions / total_questions) * 100 if total_questions > 0 else 0
-    )
-
-    return {
-        "corrects": correct_questions,
-        "questions": total_questions,
-        "score": score_percentage,
-    }
+    return temp_ans
 
 
 @student_router.get("/c")
+@writes
 async def c(request: Request):
     request.session.clear()
     await db.pool.execute("DELETE FROM attempts")
@@ -139,51 +238,16 @@ async def c(request: Request):
 
 
 @student_router.get("")
-async def siswa_page(request: Request):
-    logged_in, payload = check_jwt(request, "student")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
+async def siswa_page(request: Request, payload: dict = Depends(student_session)):
     # start
-    exams = await db.pool.fetch(
-        """
-        SELECT
-            e.id AS exam_id,
-            e.pack_id,
-            e.archived,
-            e.max_attempts,
-            p.name AS pack_name,
-            m.id AS module_id,
-            m.name AS module_name,
-            e.proctor_id,
-            e.name AS exam_name,
-            e.start_dt,
-            e.end_dt,
-            e.time_limit
-        FROM
-            exams e
-        JOIN
-            packs p ON e.pack_id = p.id
-        JOIN
-            modules m ON p.module_id = m.id
-        ORDER BY e.id
-    """
-    )
-    attempt = await get_attempt(payload["id"])
-    user_attempts = await db.pool.fetch(
+    pool = db.reader(request)
+    exams = await get_exam_details()
+    attempt = await get_attempt(payload["id"], pool)
+    user_attempts = await pool.fetch(
         "SELECT COUNT(*), exam_id FROM attempts WHERE student_id = $1 GROUP BY exam_id;",
         payload["id"],
     )
-    packs = await db.pool.fetch(
-        """
-        SELECT packs.id, packs.name, packs.module_id, COUNT(questions) AS question_count
-        FROM packs
-        LEFT JOIN questions ON packs.id = questions.pack_id
-        GROUP BY packs.id, packs.name;                            
-    """
-    )
-    packs = [dict(pack) for pack in packs]
+    packs = await get_packs()
 
     return templates.TemplateResponse(
         "siswa.html",
@@ -200,41 +264,12 @@ async def siswa_page(request: Request):
 
 
 @student_router.get("/masuk_ujian/{exam_id}")
-async def enter_exam(request: Request, exam_id: int):
-    logged_in, payload = check_jwt(request, "student")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
+async def enter_exam(
+    request: Request, exam_id: int, payload: dict = Depends(student_session)
+):
     # start
-    exams = await db.pool.fetch("SELECT * FROM exams ORDER BY start_dt")
-    exam = await db.pool.fetchrow(
-        """
-        SELECT
-            e.id AS exam_id,
-            e.pack_id,
-            e.archived,
-            e.max_attempts,
-            e.show_score,
-            p.name AS pack_name,
-            m.id AS module_id,
-            m.name AS module_name,
-            e.proctor_id,
-            e.name AS exam_name,
-            e.start_dt,
-            e.end_dt,
-            e.time_limit
-        FROM
-            exams e
-        JOIN
-            packs p ON e.pack_id = p.id
-        JOIN
-            modules m ON p.module_id = m.id
-        WHERE
-            e.id = $1
-    """,
-        exam_id,
-    )
+    exams = await get_exams()
+    exam = await get_exam_detail(exam_id)
     if not exam:
         return RedirectResponse("/")
 
@@ -246,21 +281,9 @@ async def enter_exam(request: Request, exam_id: int):
         payload["id"],
     )
 
-    pack = await db.pool.fetchrow(
-        """
-        SELECT packs.id, packs.name, packs.module_id, COUNT(questions) AS question_count
-        FROM packs
-        LEFT JOIN questions ON packs.id = questions.pack_id
-        WHERE packs.id = $1
-        GROUP BY packs.id, packs.name, packs.module_id;                         
-    """,
-        exam["pack_id"],
-    )
+    pack = await get_pack(exam["pack_id"])
 
-    scores = {
-        a["id"]: await get_attempt_scoring(a["id"], pack["question_count"])
-        for a in attempts
-    }
+    scores = await get_attempts_scoring(a["id"] for a in attempts)
 
     return templates.TemplateResponse(
         "siswa_masuk_ujian.html",
@@ -280,12 +303,10 @@ async def enter_exam(request: Request, exam_id: int):
 
 
 @student_router.get("/mulai_ujian/{exam_id}")
-async def start_exam(request: Request, exam_id: int):
-    logged_in, payload = check_jwt(request, "student")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
+@writes
+async def start_exam(
+    request: Request, exam_id: int, payload: dict = Depends(student_session)
+):
     # start
     attempt = await db.pool.fetchrow(
         "SELECT * FROM attempts WHERE student_id = $1 AND end_dt IS NULL", payload["id"]
@@ -293,33 +314,7 @@ async def start_exam(request: Request, exam_id: int):
     if attempt:
         return RedirectResponse("/siswa/ujian")
 
-    exam = await db.pool.fetchrow(
-        """
-        SELECT
-            e.id AS exam_id,
-            e.pack_id,
-            e.archived,
-            e.max_attempts,
-            e.show_score,
-            p.name AS pack_name,
-            m.id AS module_id,
-            m.name AS module_name,
-            e.proctor_id,
-            e.name AS exam_name,
-            e.start_dt,
-            e.end_dt,
-            e.time_limit
-        FROM
-            exams e
-        JOIN
-            packs p ON e.pack_id = p.id
-        JOIN
-            modules m ON p.module_id = m.id
-        WHERE
-            e.id = $1
-    """,
-        exam_id,
-    )
+    exam = await get_exam_detail(exam_id)
     if not exam:
         return RedirectResponse("/")
 
@@ -338,259 +333,252 @@ async def start_exam(request: Request, exam_id: int):
         return RedirectResponse("/")
 
     start_dt = dt.datetime.now(pytz.timezone('Asia/Jakarta')).replace(tzinfo=None)
-    await db.pool.execute(
-        "INSERT INTO attempts (exam_id, student_id, start_dt, current_question) VALUES ($1, $2, $3, 1)",
+    try:
+        attempt_id = await db.pool.fetchval(
+            "INSERT INTO attempts (exam_id, student_id, start_dt, current_question) VALUES ($1, $2, $3, 1) RETURNING id",
+            exam_id,
+            payload["id"],
+            start_dt,
+        )
+    except asyncpg.UniqueViolationError:
+        # a concurrent request already opened an attempt for this student
+        return RedirectResponse("/siswa/ujian")
+    attempt = attempt_from_exam(exam, attempt_id, payload["id"], start_dt, 1)
+    ctx = AttemptContext(payload, attempt, await get_pack_snapshot(exam["pack_id"]))
+    scheduler.schedule(attempt_id, ctx.ends_at)
+    monitor.publish(
         exam_id,
-        payload["id"],
-        start_dt,
+        "started",
+        attempt_id=attempt_id,
+        student_id=payload["id"],
+        student_name=payload["name"],
+        start_dt=start_dt,
+        ends_at=ctx.ends_at,
+        current_question=1,
     )
 
     await add_log(payload, f"Memulai ujian `{exam['exam_name']}`")
-    return RedirectResponse("/siswa/ujian")
+    return ctx.set_token(RedirectResponse("/siswa/ujian"))
 
 
 @student_router.get("/ujian")
-async def exam_page(request: Request):
-    logged_in, payload = check_jwt(request, "student")
-
-    if not logged_in:
+async def exam_page(request: Request, ctx: AttemptContext = Depends(attempt_context)):
+    if not ctx:
         return RedirectResponse("/")
 
-    attempt = await db.pool.fetchrow(
-        "SELECT * FROM attempts WHERE student_id = $1 AND end_dt IS NULL", payload["id"]
-    )
-    if not attempt:
-        return RedirectResponse("/")
     # start
-    attempt = await get_attempt(payload["id"])
-
-    question_count = await db.pool.fetchval(
-        "SELECT COUNT(*) FROM questions WHERE pack_id = $1",
-        attempt["pack_id"],
-    )
-    current_question = attempt["current_question"]
-    if current_question < 1:
-        current_question = 1
-    elif current_question > question_count:
-        current_question = question_count
-    await db.pool.execute(
-        "UPDATE attempts SET current_question = $1 WHERE id = $2",
-        current_question,
-        attempt["id"],
-    )
-
-    # session = request.session.get("exam")
-    attempt = await get_attempt(payload["id"])
-    question = await db.pool.fetchrow(
-        'SELECT id, question_html FROM questions WHERE pack_id = $1 AND "order" = $2',
-        attempt["pack_id"],
-        attempt["current_question"],
-    )
-    questions = await db.pool.fetch(
-        'SELECT id, "order" FROM questions WHERE pack_id = $1 ORDER BY "order"',
-        attempt["pack_id"],
-    )
-    answers = await db.pool.fetch(
-        "SELECT id, answer_text, is_correct FROM answers WHERE question_id = $1",
-        question["id"],
-    )
-    question_count = await db.pool.fetchval(
-        "SELECT COUNT(*) FROM questions WHERE pack_id = $1", attempt["pack_id"]
-    )
-
-    if attempt["time_limit"] and attempt["exam_end_dt"]:
-        interv = min(
-            attempt["time_limit"],
-            (attempt["exam_end_dt"] - attempt["exam_start_dt"]).total_seconds(),
-        )
-    elif attempt["time_limit"]:
-        interv = attempt["time_limit"].total_seconds()
-    elif attempt["exam_end_dt"]:
-        interv = (attempt["exam_end_dt"] - attempt["start_dt"]).total_seconds()
-    else:
-        interv = None
-
-    ends_at = None
-    if interv:
-        ends_at = attempt["start_dt"] + dt.timedelta(seconds=interv)
-
-    n_correct = sum([1 for ans in answers if ans["is_correct"]])
-    return templates.TemplateResponse(
+    response = templates.TemplateResponse(
         "siswa_ujian.html",
         {
             "request": request,
-            "siswa": payload,
-            "attempt": attempt,
-            "questions": questions,
-            "question": question,
-            "answers": answers,
-            "question_count": question_count,
-            "temp_answers": await get_temp_ans(attempt["id"]),
-            "ends_at": ends_at,
-            "q_type": "single" if n_correct == 1 else "mul",
+            "siswa": ctx.payload,
+            "attempt": ctx.attempt,
+            "questions": ctx.pack.questions,
+            "question": ctx.question,
+            "answers": ctx.question.answers if ctx.question else (),
+            "question_count": ctx.pack.question_count,
+            "temp_answers": await get_temp_ans(ctx.attempt["id"]),
+            "ends_at": ctx.ends_at,
+            "q_type": "single" if ctx.question and ctx.question.correct_count == 1 else "mul",
         },
     )
+    if not ctx.from_token:
+        ctx.set_token(response)
 
+    return response
 
-@student_router.get("/ujian/konfirmasi")
-async def confirm_page(request: Request):
-    logged_in, payload = check_jwt(request, "student")
 
-    if not logged_in:
+@student_router.get("/ujian/konfirmasi")
+async def confirm_page(
+    request: Request, ctx: AttemptContext = Depends(attempt_context)
+):
+    if not ctx:
         return RedirectResponse("/")
 
     # start
-    attempt = await db.pool.fetchrow(
-        "SELECT * FROM attempts WHERE student_id = $1 AND end_dt IS NULL", payload["id"]
-    )
-    if not attempt:
-        return RedirectResponse("/")
-
-    attempt = await get_attempt(payload["id"])
-    # session = request.session.get("exam")
-    questions = await db.pool.fetch(
-        'SELECT id, "order" FROM questions WHERE pack_id = $1 ORDER BY "order"',
-        attempt["pack_id"],
-    )
-
-    if attempt["time_limit"] and attempt["exam_end_dt"]:
-        interv = min(
-            attempt["time_limit"],
-            (attempt["exam_end_dt"] - attempt["exam_start_dt"]).total_seconds(),
-        )
-    elif attempt["time_limit"]:
-        interv = attempt["time_limit"].total_seconds()
-    elif attempt["exam_end_dt"]:
-        interv = (attempt["exam_end_dt"] - attempt["start_dt"]).total_seconds()
-    else:
-        interv = None
-
-    ends_at = None
-    if interv:
-        ends_at = attempt["start_dt"] + dt.timedelta(seconds=interv)
-
     return templates.TemplateResponse(
         "siswa_ujian_konfirmasi.html",
         {
             "request": request,
-            "siswa": payload,
-            "questions": questions,
-            "temp_answers": await get_temp_ans(attempt["id"]),
-            "attempt": attempt,
-            "ends_at": ends_at,
+            "siswa": ctx.payload,
+            "questions": ctx.pack.questions,
+            "temp_answers": await get_temp_ans(ctx.attempt["id"]),
+            "attempt": ctx.attempt,
+            "ends_at": ctx.ends_at,
         },
     )
 
 
 @student_router.post("/ujian/change_ans")
-async def change_answer(request: Request, ans: List[int] = Form([])):
-    logged_in, payload = check_jwt(request, "student")
-
-    if not logged_in:
+async def change_answer(
+    ans: List[int] = Form([]), ctx: AttemptContext = Depends(attempt_context)
+):
+    if not ctx:
         return RedirectResponse("/")
 
     # start
-    attempt = await db.pool.fetchrow(
-        "SELECT * FROM attempts WHERE student_id = $1 AND end_dt IS NULL", payload["id"]
-    )
-    if not attempt:
-        return RedirectResponse("/")
-
-    attempt = await get_attempt(payload["id"])
-    q_id = await db.pool.fetchval(
-        'SELECT id FROM questions WHERE pack_id = $1 AND "order" = $2',
-        attempt["pack_id"],
-        attempt["current_question"],
-    )
+    if not ctx.question:
+        return RedirectResponse("/siswa/ujian", 303)
+
+    if answer_buffer:
+        answer_buffer.record(ctx.attempt["id"], ctx.question.id, ans)
+        monitor.publish(
+            ctx.attempt["exam_id"],
+            "answer",
+            attempt_id=ctx.attempt["id"],
+            question_id=ctx.question.id,
+            answered=bool(ans),
+        )
+        return RedirectResponse("/siswa/ujian")
 
     await db.pool.execute(
-        "INSERT INTO temp_answers (attempt_id, question_id, chosen_answers) "
-        "VALUES ($1, $2, $3) "
+        "INSERT INTO temp_answers (attempt_id, question_id, chosen_answers, saved_dt) "
+        "SELECT $1, $2, $3, $4 WHERE EXISTS "
+        "(SELECT 1 FROM attempts WHERE id = $1 AND end_dt IS NULL) "
         "ON CONFLICT (attempt_id, question_id) "
-        "DO UPDATE SET chosen_answers = excluded.chosen_answers",
-        attempt["id"],
-        q_id,
+        "DO UPDATE SET chosen_answers = excluded.chosen_answers, saved_dt = excluded.saved_dt",
+        ctx.attempt["id"],
+        ctx.question.id,
         ans,
+        dt.datetime.now(pytz.timezone('Asia/Jakarta')).replace(tzinfo=None),
+    )
+    monitor.publish(
+        ctx.attempt["exam_id"],
+        "answer",
+        attempt_id=ctx.attempt["id"],
+        question_id=ctx.question.id,
+        answered=bool(ans),
     )
 
     return RedirectResponse("/siswa/ujian")
 
 
-@student_router.get("/ujian/jump/{q_no}")
-async def exam_jump(request: Request, q_no: int):
-    logged_in, payload = check_jwt(request, "student")
+@student_router.post("/ujian/jawab")
+async def save_answer(
+    request: Request,
+    question_id: int = Form(...),
+    ans: List[int] = Form([]),
+    payload: dict = Depends(student_api_session),
+):
+    # start
+    if answer_buffer:
+        ctx = await attempt_context(request)
+        if not ctx or question_id not in ctx.pack.question_ids:
+            return JSONResponse({"ok": False}, 404)
+
+        answer_buffer.record(ctx.attempt["id"], question_id, ans)
+        monitor.publish(
+            ctx.attempt["exam_id"],
+            "answer",
+            attempt_id=ctx.attempt["id"],
+            question_id=question_id,
+            answered=bool(ans),
+        )
+        return {"ok": True, "question_id": question_id}
 
-    if not logged_in:
-        return RedirectResponse("/")
+    saved = await db.pool.fetchrow(
+        """
+        WITH saved AS (
+            INSERT INTO temp_answers (attempt_id, question_id, chosen_answers, saved_dt)
+            SELECT a.id, q.id, $3, $4
+            FROM attempts a
+            JOIN exams e ON
+                a.exam_id = e.id
+            JOIN questions q ON
+                q.pack_id = e.pack_id AND q.id = $2
+            WHERE a.student_id = $1 AND a.end_dt IS NULL
+            ON CONFLICT (attempt_id, question_id)
+            DO UPDATE SET chosen_answers = excluded.chosen_answers, saved_dt = excluded.saved_dt
+            RETURNING attempt_id, question_id
+        )
+        SELECT s.attempt_id, s.question_id, a.exam_id
+        FROM saved s
+        JOIN attempts a ON
+            a.id = s.attempt_id
+    """,
+        payload["id"],
+        question_id,
+        ans,
+        dt.datetime.now(pytz.timezone('Asia/Jakarta')).replace(tzinfo=None),
+    )
+    if not saved:
+        return JSONResponse({"ok": False}, 404)
 
-    # start
-    attempt = await db.pool.fetchrow(
-        "SELECT * FROM attempts WHERE student_id = $1 AND end_dt IS NULL", payload["id"]
+    monitor.publish(
+        saved["exam_id"],
+        "answer",
+        attempt_id=saved["attempt_id"],
+        question_id=saved["question_id"],
+        answered=bool(ans),
     )
-    if not attempt:
+    return {"ok": True, "question_id": saved["question_id"]}
+
+
+@student_router.get("/ujian/jump/{q_no}")
+@writes
+async def exam_jump(q_no: int, ctx: AttemptContext = Depends(attempt_context)):
+    if not ctx:
         return RedirectResponse("/")
 
-    attempt = await get_attempt(payload["id"])
+    # start
+    current_question = ctx.clamp(q_no)
     await db.pool.execute(
-        "UPDATE attempts SET current_question = $1 WHERE id = $2", q_no, attempt["id"]
+        "UPDATE attempts SET current_question = $1 WHERE id = $2",
+        current_question,
+        ctx.attempt["id"],
+    )
+    monitor.publish(
+        ctx.attempt["exam_id"],
+        "question",
+        attempt_id=ctx.attempt["id"],
+        current_question=current_question,
     )
 
-    return RedirectResponse("/siswa/ujian")
+    return ctx.set_token(RedirectResponse("/siswa/ujian"), current_question)
 
 
 @student_router.get("/ujian/done")
-async def exam_done(request: Request):
-    logged_in, payload = check_jwt(request, "student")
-
-    if not logged_in:
+@writes
+async def exam_done(ctx: AttemptContext = Depends(attempt_context)):
+    if not ctx:
         return RedirectResponse("/")
 
     # start
-    attempt = await db.pool.fetchrow(
-        "SELECT * FROM attempts WHERE student_id = $1 AND end_dt IS NULL", payload["id"]
-    )
-    if not attempt:
-        return RedirectResponse("/")
-
-    attempt = await get_attempt(payload["id"])
-    await db.pool.execute(
-        "UPDATE attempts SET end_dt = $1 WHERE id = $2",
-        dt.datetime.now(pytz.timezone('Asia/Jakarta')).replace(tzinfo=None),
+    attempt = ctx.attempt
+    if answer_buffer:
+        await answer_buffer.flush()
+
+    end_dt = dt.datetime.now(pytz.timezone('Asia/Jakarta')).replace(tzinfo=None)
+    finished = await db.pool.fetchval(
+        "UPDATE attempts SET end_dt = $1 WHERE id = $2 AND end_dt IS NULL RETURNING id",
+        end_dt,
         attempt["id"],
     )
+    scheduler.cancel(attempt["id"])
+    await store_attempts_scoring([attempt["id"]])
+    if finished:
+        scores = await get_attempts_scoring([attempt["id"]])
+        monitor.publish(
+            attempt["exam_id"],
+            "finished",
+            attempt_id=attempt["id"],
+            end_dt=end_dt,
+            score=scores.get(attempt["id"], {}).get("score"),
+        )
 
-    exam = await db.pool.fetchrow("SELECT * FROM exams WHERE id = $1", attempt["exam_id"])
-
-    await add_log(payload, f"Menyelesaikan ujian `{exam['name']}`")
-    return RedirectResponse(f"/siswa/masuk_ujian/{attempt['exam_id']}")
+    await add_log(ctx.payload, f"Menyelesaikan ujian `{attempt['exam_name']}`")
+    response = RedirectResponse(f"/siswa/masuk_ujian/{attempt['exam_id']}")
+    response.delete_cookie("ujian")
+    return response
 
 
 @student_router.get("/percobaan")
-async def student_attempts(request: Request):
-    logged_in, payload = check_jwt(request, "student")
-
-    if not logged_in:
-        return RedirectResponse("/")
-
+async def student_attempts(request: Request, payload: dict = Depends(student_session)):
     # start
-    exams = await db.pool.fetch("SELECT * FROM exams start_dt")
-    attempts = await get_all_user_attempt(payload["id"])
-    packs = await db.pool.fetch(
-        """
-            SELECT packs.id, packs.name, packs.module_id, COUNT(questions) AS question_count
-            FROM packs
-            LEFT JOIN questions ON packs.id = questions.pack_id
-            GROUP BY packs.id, packs.name;                            
-        """
-    )
-
-    scores = {}
-    for a in attempts:
-        for p in packs:
-            if a["pack_id"] == p["id"]:
-                scores[a["id"]] = await get_attempt_scoring(
-                    a["id"], p["question_count"]
-                )
+    pool = db.reader(request)
+    exams = await get_exams()
+    attempts = await get_all_user_attempt(payload["id"], pool)
+    scores = await get_attempts_scoring((a["id"] for a in attempts), pool)
 
     return templates.TemplateResponse(
         "siswa_percobaan.html",
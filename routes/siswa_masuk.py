@@ -1,7 +1,8 @@
 from fastapi import APIRouter, Request, Form
 from fastapi.responses import RedirectResponse
 
-from utils import db, templates, encode_jwt
+from utils import templates
+from auth import authenticate, login_allowed, login_failed, sessions
 
 login_router = APIRouter(prefix="/masuk")
 
@@ -17,14 +18,20 @@ async def student_login_page(request: Request):
 async def student_login(
     request: Request, username: str = Form(...), password: str = Form(...)
 ):
-    # hashed = hash_pass(password)
-    student = await db.pool.fetchrow(
-        "SELECT * FROM students WHERE username = $1 AND pass_hash = $2",
-        username,
-        password,
+    if not login_allowed(request, username):
+        return templates.TemplateResponse(
+            "login.html",
+            {"request": request, "user_type": "siswa", "status": False, "limited": True},
+            429,
+        )
+
+    # usernames are stored lowercase
+    student = await authenticate(
+        "students", username.lower(), password, "plain", "NOT archived"
     )
 
     if not student:
+        login_failed(request)
         return templates.TemplateResponse(
             "login.html", {"request": request, "user_type": "siswa", "status": False}
         )
@@ -35,7 +42,7 @@ async def student_login(
         "username": student["username"],
         "name": student["name"],
     }
-    encoded_jwt = encode_jwt(payload)
+    encoded_jwt = sessions.issue(payload)
 
     response = RedirectResponse("/siswa", 303)
     response.set_cookie("monde", encoded_jwt)
@@ -0,0 +1,283 @@
+import datetime as dt
+import asyncio
+import heapq
+import os
+
+import pytz
+
+from utils import db, get_ends_at
+from scoring import store_attempts_scoring, get_attempts_scoring
+from answer_buffer import answer_buffer
+from monitor import monitor
+
+
+OPEN_ATTEMPTS_QUERY = """
+    SELECT
+        a.id,
+        a.exam_id,
+        a.start_dt,
+        e.start_dt AS exam_start_dt,
+        e.end_dt AS exam_end_dt,
+        e.time_limit
+    FROM attempts a
+    LEFT JOIN exams e ON
+        a.exam_id = e.id
+    WHERE a.end_dt IS NULL AND {condition}
+"""
+
+CHANNEL = "attempt_deadlines"
+# deadlines per notify, pg_notify refuses payloads of 8000 bytes or more
+NOTIFY_BATCH = 200
+
+
+def _now():
+    return dt.datetime.now(pytz.timezone("Asia/Jakarta")).replace(tzinfo=None)
+
+
+class AttemptScheduler:
+    def __init__(self, resync_interval=10, leader_retry=3, lock_key=None):
+        self.resync_interval = resync_interval
+        self.leader_retry = leader_retry
+        # every process competes for this advisory lock, only the holder closes attempts
+        self.lock_key = lock_key
+        self.is_leader = False
+        self.heap = []
+        self.deadlines = {}
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.closed_count = 0
+        self.task = None
+        self.wakeup = asyncio.Event()
+        self.outbox = []
+        self.announcer = None
+
+    def schedule(self, attempt_id, ends_at):
+        # standby processes keep nothing, they pass the deadline to the leader
+        if not self.is_leader:
+            self._announce(attempt_id, ends_at)
+            return
+        if self.deadlines.get(attempt_id) == ends_at:
+            return
+
+        if ends_at is None:
+            self.deadlines.pop(attempt_id, None)
+            return
+
+        self.deadlines[attempt_id] = ends_at
+        heapq.heappush(self.heap, (ends_at, attempt_id))
+        self.wakeup.set()
+
+    def _announce(self, attempt_id, ends_at):
+        # without this the leader only sees the attempt at its next resync
+        if self.lock_key is None or self.task is None:
+            return
+
+        self.outbox.append(f"{attempt_id}={ends_at.isoformat() if ends_at else ''}")
+        if self.announcer is None or self.announcer.done():
+            self.announcer = asyncio.create_task(self._send())
+
+    async def _send(self):
+        while self.outbox:
+            chunk, self.outbox = self.outbox[:NOTIFY_BATCH], self.outbox[NOTIFY_BATCH:]
+            try:
+                await db.pool.execute("SELECT pg_notify($1, $2)", CHANNEL, ",".join(chunk))
+            except Exception as e:
+                # the resync still picks these up
+                print(f"scheduler: announce failed: {e}")
+
+    def _on_notify(self, conn, pid, channel, payload):
+        for item in payload.split(","):
+            attempt_id, ends_at = item.split("=")
+            self.schedule(int(attempt_id), dt.datetime.fromisoformat(ends_at) if ends_at else None)
+
+    def cancel(self, attempt_id):
+        # stale heap entries are skipped when they reach the top
+        if self.is_leader:
+            self.deadlines.pop(attempt_id, None)
+
+    async def load(self, condition="TRUE", *args):
+        rows = await db.pool.fetch(OPEN_ATTEMPTS_QUERY.format(condition=condition), *args)
+        deadlines = []
+        for row in rows:
+            ends_at = get_ends_at(
+                row["start_dt"],
+                row["time_limit"],
+                row["exam_start_dt"],
+                row["exam_end_dt"],
+            )
+            self.schedule(row["id"], ends_at)
+            deadlines.append((row["id"], row["exam_id"], ends_at))
+
+        return deadlines
+
+    async def reschedule_exam(self, exam_id):
+        for attempt_id, _, ends_at in await self.load("a.exam_id = $1", exam_id):
+            monitor.publish(exam_id, "time", attempt_id=attempt_id, ends_at=ends_at)
+
+    def _pop_due(self, now):
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            ends_at, attempt_id = heapq.heappop(self.heap)
+            if self.deadlines.get(attempt_id) != ends_at:
+                continue
+
+            del self.deadlines[attempt_id]
+            due.append((ends_at, attempt_id))
+
+        return due
+
+    def _next_deadline(self):
+        while self.heap and self.deadlines.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+
+        return self.heap[0][0] if self.heap else None
+
+    async def close_due(self):
+        now = _now()
+        due = self._pop_due(now)
+        if not due:
+            return
+
+        self.last_lag = (now - due[0][0]).total_seconds()
+        self.max_lag = max(self.max_lag, self.last_lag)
+
+        if answer_buffer:
+            await answer_buffer.flush()
+
+        rows = await db.pool.fetch(
+            "UPDATE attempts SET end_dt = $1 WHERE id = ANY($2::int[]) AND end_dt IS NULL RETURNING id, exam_id",
+            now,
+            [attempt_id for _, attempt_id in due],
+        )
+        closed = [row["id"] for row in rows]
+        self.closed_count += len(closed)
+        await store_attempts_scoring(closed)
+
+        scores = await get_attempts_scoring(closed)
+        for row in rows:
+            monitor.publish(
+                row["exam_id"],
+                "finished",
+                attempt_id=row["id"],
+                end_dt=now,
+                score=scores.get(row["id"], {}).get("score"),
+            )
+            print(f"attempt: {row['id']} is finished")
+
+    async def resync(self):
+        known = dict(self.deadlines)
+        deadlines = await self.load()
+        for attempt_id, exam_id, ends_at in deadlines:
+            # an exam edited in another process, its dashboards learn it from here
+            if attempt_id in known and known[attempt_id] != ends_at:
+                monitor.publish(exam_id, "time", attempt_id=attempt_id, ends_at=ends_at)
+
+        # attempts closed by exam_done in another process
+        for attempt_id in self.deadlines.keys() - {row[0] for row in deadlines}:
+            self.cancel(attempt_id)
+
+    async def lead(self, conn=None):
+        self.is_leader = True
+        self.heap = []
+        self.deadlines = {}
+        if conn is not None:
+            # listening before the load so no attempt falls in between
+            await conn.add_listener(CHANNEL, self._on_notify)
+        try:
+            await self._lead(conn)
+        finally:
+            if conn is not None and not conn.is_closed():
+                await conn.remove_listener(CHANNEL, self._on_notify)
+
+    async def _lead(self, conn):
+        await self.load()
+        last_resync = _now()
+
+        while conn is None or not conn.is_closed():
+            self.wakeup.clear()
+            await self.close_due()
+
+            now = _now()
+            if (now - last_resync).total_seconds() >= self.resync_interval:
+                if conn is not None:
+                    # fail fast if the session holding the lock is gone
+                    await conn.execute("SELECT 1")
+
+                # every open deadline is recomputed, so attempts started and
+                # exams edited in other processes are picked up
+                await self.resync()
+                last_resync = now
+                continue
+
+            timeout = self.resync_interval
+            next_deadline = self._next_deadline()
+            if next_deadline:
+                timeout = min(timeout, max((next_deadline - now).total_seconds(), 0))
+
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        while self.lock_key is None:
+            try:
+                await self.lead()
+            except Exception as e:
+                # a failed close must not stop expiry for good, start over from the table
+                print(f"scheduler: {e}")
+
+            await asyncio.sleep(self.leader_retry)
+
+        while True:
+            try:
+                # the lock is session scoped, it is dropped by the pool reset
+                # on release or by the server when this process dies
+                async with db.session().acquire() as conn:
+                    if await conn.fetchval(
+                        "SELECT pg_try_advisory_lock($1)", self.lock_key
+                    ):
+                        print("scheduler: acquired leadership")
+                        await self.lead(conn)
+            except Exception as e:
+                print(f"scheduler: {e}")
+            finally:
+                self.is_leader = False
+
+            await asyncio.sleep(self.leader_retry)
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    def status(self):
+        next_deadline = self._next_deadline()
+        behind = 0.0
+        if next_deadline:
+            behind = max((_now() - next_deadline).total_seconds(), 0.0)
+
+        return {
+            "running": self.task is not None and not self.task.done(),
+            "leader": self.is_leader,
+            "pending": len(self.deadlines),
+            "next_deadline": next_deadline,
+            "behind_seconds": behind,
+            "lag_seconds": self.last_lag,
+            "max_lag_seconds": self.max_lag,
+            "closed": self.closed_count,
+        }
+
+
+lock_key = os.environ.get("SCHEDULER_LOCK_KEY", "8245")
+scheduler = AttemptScheduler(
+    resync_interval=int(os.environ.get("SCHEDULER_RESYNC_INTERVAL", 10)),
+    lock_key=int(lock_key) if lock_key else None,
+)
@@ -0,0 +1,181 @@
+import datetime as dt
+
+import pytz
+
+from utils import db
+
+
+SCORING_QUERY = """
+    WITH scoped_attempts AS (
+        SELECT at.id, e.pack_id
+        FROM attempts at
+        LEFT JOIN exams e ON
+            at.exam_id = e.id
+        WHERE {condition}
+    ),
+    per_question AS (
+        SELECT
+            ta.attempt_id,
+            ta.question_id,
+            COUNT(*) FILTER (WHERE a.is_correct AND a.id = ANY(ta.chosen_answers)) AS chosen_correct_count,
+            COUNT(*) FILTER (WHERE a.is_correct) AS total_correct_count,
+            COUNT(*) FILTER (WHERE NOT a.is_correct AND a.id = ANY(ta.chosen_answers)) AS chosen_incorrect_count
+        FROM
+            temp_answers ta
+            INNER JOIN answers a ON ta.question_id = a.question_id
+        WHERE
+            ta.attempt_id IN (SELECT id FROM scoped_attempts)
+        GROUP BY
+            ta.attempt_id, ta.question_id
+    )
+    SELECT
+        sa.id AS attempt_id,
+        (SELECT COUNT(*) FROM questions q WHERE q.pack_id = sa.pack_id) AS question_count,
+        COUNT(pq.question_id) FILTER (
+            WHERE CASE
+                WHEN pq.total_correct_count = 1 THEN
+                    pq.chosen_correct_count = 1 AND pq.chosen_incorrect_count = 0
+                ELSE
+                    pq.chosen_correct_count = pq.total_correct_count AND pq.chosen_incorrect_count = 0
+            END
+        ) AS correct_count
+    FROM scoped_attempts sa
+    LEFT JOIN per_question pq ON
+        pq.attempt_id = sa.id
+    GROUP BY sa.id, sa.pack_id
+"""
+
+
+STORE_QUERY = """
+    INSERT INTO attempt_scores (attempt_id, corrects, questions, score, scored_dt)
+    SELECT
+        s.attempt_id,
+        s.correct_count,
+        s.question_count,
+        CASE
+            WHEN s.question_count > 0 THEN (s.correct_count * 100.0 / s.question_count)::double precision
+            ELSE 0
+        END,
+        $2
+    FROM ({scoring}) s
+    ON CONFLICT (attempt_id) DO UPDATE SET
+        corrects = excluded.corrects,
+        questions = excluded.questions,
+        score = excluded.score,
+        scored_dt = excluded.scored_dt
+"""
+
+
+def make_score(correct_questions, total_questions):
+    score_percentage = (
+        (correct_questions / total_questions) * 100 if total_questions > 0 else 0
+    )
+
+    return {
+        "corrects": correct_questions,
+        "questions": total_questions,
+        "score": score_percentage,
+    }
+
+
+async def _fetch_scoring(condition, arg):
+    rows = await db.pool.fetch(SCORING_QUERY.format(condition=condition), arg)
+    return {
+        row["attempt_id"]: make_score(row["correct_count"], row["question_count"])
+        for row in rows
+    }
+
+
+async def _fetch_stored(condition, arg, pool=None):
+    rows = await (pool or db.pool).fetch(
+        f"""
+        SELECT at.id AS attempt_id, s.corrects, s.questions, s.score
+        FROM attempts at
+        LEFT JOIN attempt_scores s ON
+            s.attempt_id = at.id
+        WHERE {condition}
+    """,
+        arg,
+    )
+
+    scores = {}
+    missing = []
+    for row in rows:
+        if row["score"] is None:
+            missing.append(row["attempt_id"])
+        else:
+            scores[row["attempt_id"]] = {
+                "corrects": row["corrects"],
+                "questions": row["questions"],
+                "score": row["score"],
+            }
+
+    return scores, missing
+
+
+async def store_attempts_scoring(attempt_ids):
+    attempt_ids = list(attempt_ids)
+    if not attempt_ids:
+        return
+
+    # only finished attempts are persisted, open ones are still changing
+    scoring = SCORING_QUERY.format(
+        condition="at.id = ANY($1::int[]) AND at.end_dt IS NOT NULL"
+    )
+    await db.pool.execute(
+        STORE_QUERY.format(scoring=scoring),
+        attempt_ids,
+        dt.datetime.now(pytz.timezone("Asia/Jakarta")).replace(tzinfo=None),
+    )
+
+
+async def _get_scoring(condition, arg, pool=None):
+    scores, missing = await _fetch_stored(condition, arg, pool)
+    if not missing:
+        return scores
+
+    # attempts finished before they could be persisted are filled in lazily,
+    # always on the primary
+    await store_attempts_scoring(missing)
+    stored, missing = await _fetch_stored("at.id = ANY($1::int[])", missing)
+    scores.update(stored)
+
+    if missing:
+        scores.update(await _fetch_scoring("at.id = ANY($1::int[])", missing))
+
+    return scores
+
+
+async def get_attempts_scoring(attempt_ids, pool=None):
+    attempt_ids = list(attempt_ids)
+    if not attempt_ids:
+        return {}
+
+    return await _get_scoring("at.id = ANY($1::int[])", attempt_ids, pool)
+
+
+async def get_exam_scoring(exam_id, pool=None):
+    return await _get_scoring("at.exam_id = $1", exam_id, pool)
+
+
+async def invalidate_pack_scoring(pack_id):
+    await db.pool.execute(
+        """
+        DELETE FROM attempt_scores
+        WHERE attempt_id IN (
+            SELECT a.id
+            FROM attempts a
+            JOIN exams e ON
+                a.exam_id = e.id
+            WHERE e.pack_id = $1
+        )
+    """,
+        pack_id,
+    )
+
+
+async def invalidate_exam_scoring(exam_id):
+    await db.pool.execute(
+        "DELETE FROM attempt_scores WHERE attempt_id IN (SELECT id FROM attempts WHERE exam_id = $1)",
+        exam_id,
+    )
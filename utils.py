@@ -1,7 +1,9 @@
+from collections import deque
 import datetime as dt
 import hashlib
-import asyncpg
 import asyncio
+import asyncpg
+import time
 import pytz
 import jwt
 import os
@@ -12,16 +14,204 @@ import dotenv
 dotenv.load_dotenv()
 
 SECRET = os.environ["SECRET"]
+ATTEMPT_TOKEN_TTL = int(os.environ.get("ATTEMPT_TOKEN_TTL", 120))
+
+
+def _env_float(name, default=None):
+    value = os.environ.get(name)
+    return float(value) if value else default
+
+
+class _TimedAcquire:
+    # wraps the public acquire context, usable with both `await` and `async with`
+    def __init__(self, pool, context):
+        self.pool = pool
+        self.context = context
+
+    async def _timed(self, acquire):
+        started = time.monotonic()
+        self.pool.waiting += 1
+        try:
+            return await acquire
+        finally:
+            self.pool.waiting -= 1
+            waited = time.monotonic() - started
+            self.pool.acquire_count += 1
+            self.pool.wait_total += waited
+            self.pool.wait_max = max(self.pool.wait_max, waited)
+
+    def __await__(self):
+        return self._timed(self.context).__await__()
+
+    async def __aenter__(self):
+        return await self._timed(self.context.__aenter__())
+
+    async def __aexit__(self, *exc):
+        return await self.context.__aexit__(*exc)
+
+
+class StatsPool(asyncpg.pool.Pool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.acquire_count = 0
+        self.waiting = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def acquire(self, *, timeout=None):
+        # fetch/execute on the pool acquire through here as well
+        return _TimedAcquire(self, super().acquire(timeout=timeout))
+
+
+WRITE_COOKIE = "tulis"
+WRITE_ROUTES = set()
+
+
+def writes(endpoint):
+    # GET routes that change data, they start a read-your-writes window
+    # like any other method does
+    WRITE_ROUTES.add(endpoint)
+    return endpoint
 
 
 class Database:
-    async def create_pool(self):
-        self.pool = await asyncpg.create_pool(
-            host=os.environ["DB_HOST"],
+    def __init__(self):
+        self.pool = None
+        self.replica = None
+        # session pooled connections for advisory locks and LISTEN, which a
+        # transaction pooling bouncer would hand to other clients
+        self.direct = None
+        # seconds a client keeps reading from the primary after its own write
+        self.read_your_writes = int(os.environ.get("DB_READ_YOUR_WRITES", 10))
+
+    def _create_pool(self, host, port, prefix, pgbouncer=False, min_size=10, max_size=10):
+        setup_sql = os.environ.get("DB_CONNECTION_SETUP")
+
+        async def init(conn):
+            if setup_sql:
+                await conn.execute(setup_sql)
+
+        server_settings = {"application_name": os.environ.get("DB_APPLICATION_NAME", "anbk")}
+        statement_timeout = os.environ.get("DB_STATEMENT_TIMEOUT_MS")
+        if statement_timeout:
+            server_settings["statement_timeout"] = statement_timeout
+
+        statement_cache_size = int(os.environ.get("DB_STATEMENT_CACHE", 100))
+        if pgbouncer:
+            # transaction pooling hands each query to any server connection,
+            # named prepared statements would not be found there
+            statement_cache_size = 0
+
+        return StatsPool(
+            host=host,
+            port=port,
             database=os.environ["DB_NAME"],
             user=os.environ["DB_USER"],
             password=os.environ["DB_PASS"],
+            min_size=int(os.environ.get(f"{prefix}_MIN", min_size)),
+            max_size=int(os.environ.get(f"{prefix}_MAX", max_size)),
+            max_queries=int(os.environ.get("DB_POOL_MAX_QUERIES", 50000)),
+            max_inactive_connection_lifetime=_env_float("DB_POOL_MAX_INACTIVE", 300.0),
+            statement_cache_size=statement_cache_size,
+            command_timeout=_env_float("DB_COMMAND_TIMEOUT"),
+            server_settings=server_settings,
+            init=init,
+            loop=None,
+            connection_class=asyncpg.Connection,
+            record_class=asyncpg.Record,
+        )
+
+    async def create_pool(self):
+        pgbouncer = os.environ.get("DB_PGBOUNCER") == "1"
+        if pgbouncer and not os.environ.get("DB_DIRECT_HOST"):
+            raise RuntimeError(
+                "DB_PGBOUNCER=1 needs DB_DIRECT_HOST for advisory locks and LISTEN"
+            )
+
+        self.pool = self._create_pool(
+            os.environ["DB_HOST"], os.environ.get("DB_PORT"), "DB_POOL", pgbouncer
         )
+        await self.pool
+
+        if os.environ.get("DB_DIRECT_HOST"):
+            self.direct = self._create_pool(
+                os.environ["DB_DIRECT_HOST"],
+                os.environ.get("DB_DIRECT_PORT"),
+                "DB_DIRECT_POOL",
+                min_size=1,
+                max_size=8,
+            )
+            await self.direct
+
+        if os.environ.get("DB_REPLICA_HOST"):
+            self.replica = self._create_pool(
+                os.environ["DB_REPLICA_HOST"],
+                os.environ.get("DB_REPLICA_PORT"),
+                "DB_REPLICA_POOL",
+                pgbouncer,
+            )
+            await self.replica
+
+    def pools(self):
+        return [pool for pool in (self.pool, self.replica, self.direct) if pool is not None]
+
+    def session(self):
+        # for connections held across transactions: locks and listeners
+        return self.direct or self.pool
+
+    def reader(self, request):
+        # only for routes that do not write, a recent write pins the client to the primary
+        if self.replica is None or request.cookies.get(WRITE_COOKIE):
+            return self.pool
+
+        return self.replica
+
+    def mark_write(self, response):
+        if self.replica is not None:
+            response.set_cookie(WRITE_COOKIE, "1", max_age=self.read_your_writes, httponly=True)
+
+    async def warm_up(self):
+        # open min_size connections now instead of on the first exam burst
+        for pool in self.pools():
+            connections = [await pool.acquire() for _ in range(pool.get_min_size())]
+            try:
+                await asyncio.gather(*(conn.execute("SELECT 1") for conn in connections))
+            finally:
+                for conn in connections:
+                    await pool.release(conn)
+
+    async def close(self):
+        for pool in self.pools():
+            try:
+                await asyncio.wait_for(
+                    pool.close(), _env_float("DB_POOL_CLOSE_TIMEOUT", 10.0)
+                )
+            except asyncio.TimeoutError:
+                pool.terminate()
+
+    def _pool_status(self, pool):
+        return {
+            "size": pool.get_size(),
+            "min_size": pool.get_min_size(),
+            "max_size": pool.get_max_size(),
+            "in_use": pool.get_size() - pool.get_idle_size(),
+            "idle": pool.get_idle_size(),
+            "waiting": pool.waiting,
+            "acquires": pool.acquire_count,
+            "wait_avg_ms": (
+                pool.wait_total / pool.acquire_count * 1000 if pool.acquire_count else 0.0
+            ),
+            "wait_max_ms": pool.wait_max * 1000,
+        }
+
+    def status(self):
+        status = self._pool_status(self.pool)
+        if self.replica is not None:
+            status["replica"] = self._pool_status(self.replica)
+        if self.direct is not None:
+            status["direct"] = self._pool_status(self.direct)
+
+        return status
 
 
 db = Database()
@@ -36,88 +226,210 @@ def encode_jwt(payload):
     return jwt.encode(payload, SECRET, algorithm="HS256")
 
 
-def check_jwt(request, user_type):
-    jwt_str = request.cookies.get("monde")
-    payload = None
-    if jwt_str:
-        try:
-            payload = jwt.decode(jwt_str, SECRET, ["HS256"])
-        except:
-            request.cookies.pop("monde")
-            logged_in = False
-        else:
-            logged_in = True
-            if not payload["type"] == user_type:
-                logged_in = False
-    else:
-        logged_in = False
+def encode_attempt_token(attempt, pack_digest, ends_at):
+    expires = dt.datetime.now(dt.timezone.utc) + dt.timedelta(seconds=ATTEMPT_TOKEN_TTL)
+    return encode_jwt(
+        {
+            "type": "attempt",
+            "id": attempt["id"],
+            "student_id": attempt["student_id"],
+            "exam_id": attempt["exam_id"],
+            "pack_id": attempt["pack_id"],
+            "pack_digest": pack_digest,
+            "start_dt": attempt["start_dt"].isoformat(),
+            "ends_at": ends_at.isoformat() if ends_at else None,
+            "current_question": attempt["current_question"],
+            "exp": expires,
+        }
+    )
+
 
-    return logged_in, payload
+def decode_attempt_token(request, student_id):
+    token = request.cookies.get("ujian")
+    if not token:
+        return None
 
+    try:
+        payload = jwt.decode(token, SECRET, ["HS256"])
+    except jwt.InvalidTokenError:
+        return None
 
-async def check_attempt_finished(attempt):
-    if attempt["time_limit"] and attempt["exam_end_dt"]:
+    if payload.get("type") != "attempt" or payload.get("student_id") != student_id:
+        return None
+
+    payload["start_dt"] = dt.datetime.fromisoformat(payload["start_dt"])
+    if payload["ends_at"]:
+        payload["ends_at"] = dt.datetime.fromisoformat(payload["ends_at"])
+    return payload
+
+
+def get_ends_at(start_dt, time_limit, exam_start_dt, exam_end_dt):
+    if time_limit and exam_end_dt:
         interv = min(
-            attempt["time_limit"],
-            (attempt["exam_end_dt"] - attempt["exam_start_dt"]).total_seconds(),
+            time_limit.total_seconds(),
+            (exam_end_dt - exam_start_dt).total_seconds(),
         )
-    elif attempt["time_limit"]:
-        interv = attempt["time_limit"].total_seconds()
-    elif attempt["exam_end_dt"]:
-        interv = (attempt["exam_end_dt"] - attempt["start_dt"]).total_seconds()
+    elif time_limit:
+        interv = time_limit.total_seconds()
+    elif exam_end_dt:
+        interv = (exam_end_dt - start_dt).total_seconds()
     else:
         interv = None
 
-    ends_at = None
     if interv:
-        ends_at = attempt["start_dt"] + dt.timedelta(seconds=interv)
-        return (
-            dt.datetime.now(pytz.timezone("Asia/Jakarta")).replace(tzinfo=None)
-            >= ends_at
-        )
+        return start_dt + dt.timedelta(seconds=interv)
 
-    return False
-
-async def worker():
-    i = 0
-    while True:
-        i += 1 
-        print(f"checking... {i}", end='\r')
-        await asyncio.sleep(3)
-        attempts = await db.pool.fetch(
-            """
-            SELECT 
-                a.id,
-                a.student_id,
-                a.start_dt,
-                a.end_dt,
-                a.current_question,
-                e.max_attempts,
-                e.id AS exam_id,
-                e.name AS exam_name,
-                e.pack_id,
-                e.proctor_id,
-                e.start_dt AS exam_start_dt,
-                e.end_dt AS exam_end_dt,
-                e.time_limit,
-                p.name AS pack_name
-            FROM attempts a
-            LEFT JOIN exams e ON
-                a.exam_id = e.id
-            LEFT JOIN packs p ON
-                e.pack_id = p.id
-            WHERE a.end_dt IS NULL
-            """
-        )
+    return None
 
-        for attempt in attempts:
-            if await check_attempt_finished(attempt):
-                await db.pool.execute(
-                    "UPDATE attempts SET end_dt = $1 WHERE id = $2",
-                    dt.datetime.now(pytz.timezone("Asia/Jakarta")).replace(tzinfo=None),
-                    attempt["id"],
-                )
-                print(f'attempt: {attempt["id"]} is finished')
+
+LOG_COLUMNS = ["actor_id", "actor_role", "actor_name", "message", "log_dt"]
+
+
+class LogSink:
+    def __init__(self, maxsize=10000, interval=0.25, batch_size=500, overflow="block", retries=3):
+        self.maxsize = maxsize
+        self.interval = interval
+        self.batch_size = batch_size
+        # block: wait for room, drop_newest / drop_oldest: discard an entry,
+        # direct: write the entry on the caller's path
+        self.overflow = overflow
+        # failed flushes of the same batch before it is written row by row
+        self.retries = retries
+        self.attempts = 0
+        self.queue = deque()
+        self.ready = asyncio.Event()
+        self.room = asyncio.Event()
+        self.lock = asyncio.Lock()
+        self.task = None
+        self.stopping = False
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.max_depth = 0
+
+    async def _write(self, rows):
+        await db.pool.copy_records_to_table("logs", records=rows, columns=LOG_COLUMNS)
+
+    async def put(self, row):
+        while self.task is not None and len(self.queue) >= self.maxsize:
+            if self.overflow == "drop_newest":
+                self.dropped += 1
+                return
+            elif self.overflow == "drop_oldest":
+                self.queue.popleft()
+                self.dropped += 1
+            elif self.overflow == "direct":
+                await self._write([row])
+                self.written += 1
+                return
+            else:
+                self.room.clear()
+                self.ready.set()
+                await self.room.wait()
+
+        if self.task is None:
+            # not running (startup, shutdown, scripts), keep the old behaviour
+            await self._write([row])
+            self.written += 1
+            return
+
+        self.queue.append(row)
+        self.max_depth = max(self.max_depth, len(self.queue))
+        if len(self.queue) >= self.batch_size:
+            self.ready.set()
+
+    async def flush(self):
+        async with self.lock:
+            while self.queue:
+                batch = [
+                    self.queue.popleft()
+                    for _ in range(min(self.batch_size, len(self.queue)))
+                ]
+                try:
+                    await self._write(batch)
+                except Exception:
+                    self.failed += 1
+                    self.attempts += 1
+                    if self.attempts < self.retries or not await self._write_rows(batch):
+                        # put the batch back in front, in order, for the next flush
+                        self.queue.extendleft(reversed(batch))
+                        raise
+                    continue
+                finally:
+                    self.room.set()
+
+                self.attempts = 0
+                self.written += len(batch)
+
+    async def _write_rows(self, batch):
+        # a row the table refuses must not hold back every row behind it; when
+        # no row gets through the database is down and nothing is dropped
+        rejected = []
+        for row in batch:
+            try:
+                await self._write([row])
+            except Exception as e:
+                rejected.append((row, e))
+            else:
+                self.written += 1
+
+        if len(rejected) == len(batch):
+            return False
+
+        for row, e in rejected:
+            print(f"log sink: dropped {row}: {e}")
+        self.dropped += len(rejected)
+        self.attempts = 0
+        return True
+
+    async def run(self):
+        while not self.stopping:
+            try:
+                await asyncio.wait_for(self.ready.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self.ready.clear()
+
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"log sink: {e}")
+
+    def start(self):
+        self.stopping = False
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            # let the loop finish its current write instead of cancelling it
+            self.stopping = True
+            self.ready.set()
+            await self.task
+            self.task = None
+
+        await self.flush()
+        self.room.set()
+
+    def status(self):
+        return {
+            "running": self.task is not None and not self.task.done(),
+            "depth": len(self.queue),
+            "max_depth": self.max_depth,
+            "capacity": self.maxsize,
+            "overflow": self.overflow,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed_flushes": self.failed,
+        }
+
+
+log_sink = LogSink(
+    maxsize=int(os.environ.get("LOG_QUEUE_SIZE", 10000)),
+    interval=int(os.environ.get("LOG_FLUSH_MS", 250)) / 1000,
+    batch_size=int(os.environ.get("LOG_BATCH_SIZE", 500)),
+    overflow=os.environ.get("LOG_OVERFLOW", "block"),
+    retries=int(os.environ.get("LOG_RETRIES", 3)),
+)
 
 
 async def add_log(payload, message):
@@ -125,11 +437,12 @@ async def add_log(payload, message):
     actor_role = payload["type"]
     actor_name = payload["name"]
 
-    await db.pool.execute(
-        "INSERT INTO logs (actor_id, actor_role, actor_name, message, log_dt) VALUES ($1, $2, $3, $4, $5)",
-        actor_id,
-        actor_role,
-        actor_name,
-        message,
-        dt.datetime.now(pytz.timezone("Asia/Jakarta")).replace(tzinfo=None),
+    await log_sink.put(
+        (
+            actor_id,
+            actor_role,
+            actor_name,
+            message,
+            dt.datetime.now(pytz.timezone("Asia/Jakarta")).replace(tzinfo=None),
+        )
     )